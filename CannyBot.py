@@ -4,12 +4,14 @@
 @subject: getting the NAO Robot to draw the shapes it "sees" using image processing.
 """
 
-import os, sys, math, motion, almath, time
+import os, sys, threading
 import numpy as np
-from StringIO import StringIO
-from PIL import Image
 import cv2
-from naoqi import ALProxy
+try:
+  from naoqi import ALProxy
+except ImportError:
+  ALProxy = None
+import camera, interpolation, trajectory, kinematics, planning, fakenao, proxies, tracelog, calibration, vision, pipeline, instrument, scheduler, planfile, robocommands
 
 """
 
@@ -22,6 +24,58 @@ UPPER_ARM_LENGTH = 105
 LOWER_ARM_LENGTH = 55.95
 SHOULDER_OFFSET_Y = 98
 SHOULDER_OFFSET_Z = 100
+right_arm = kinematics.right_arm(ELBOW_OFFSET_Y, UPPER_ARM_LENGTH, LOWER_ARM_LENGTH, SHOULDER_OFFSET_Y, SHOULDER_OFFSET_Z)
+right_arm_limits = kinematics.arm_limits("RArm")
+left_arm = kinematics.left_arm(ELBOW_OFFSET_Y, UPPER_ARM_LENGTH, LOWER_ARM_LENGTH, SHOULDER_OFFSET_Y, SHOULDER_OFFSET_Z)
+left_arm_limits = kinematics.arm_limits("LArm")
+
+# joint angles recorded at the corners of the 640 x 460 pixel workspace
+workspace_corners = [[0, 0, [0.4188239574432373, 0.3141592741012573, 0.7577540874481201, 0.5660879611968994, 0.5997520685195923, 0.7547999620437622]],
+                     [640, 0, [0.4970579743385315, -0.3497939705848694, 0.5491300821304321, 1.055433988571167, 0.9909220933914185, 0.7547999620437622]],
+                     [0, 460, [0.4157559871673584, 0.18710604310035706, 0.10273604094982147, 1.152076005935669, 1.043078064918518, 0.7547999620437622]],
+                     [640, 460, [0.5216019749641418, -0.6289819478988647, 0.2530680298805237, 1.5446163415908813, 1.0599520206451416, 0.7547999620437622]]]
+workspace = interpolation.Interpolator(workspace_corners)
+
+# calibration grid recorded with record_calibration (used instead of the
+# corners once it exists)
+workspace_calibration = "debug/calibration.npz"
+if os.path.exists(workspace_calibration):
+  workspace = interpolation.load_grid(workspace_calibration)
+
+# how far (mm) a drawing path may stray outside the box spanned by the
+# corners of the workspace (its calibration grid's, once there is one)
+WORKSPACE_MARGIN = 20
+corner_positions = right_arm.positions([corner[2] for corner in workspace.corners()])
+workspace_box = (corner_positions.min(axis=0) - WORKSPACE_MARGIN, corner_positions.max(axis=0) + WORKSPACE_MARGIN)
+
+# solve each pixel's position on the drawing surface with inverse kinematics
+# instead of interpolating joint angles between the corners
+use_inverse_kinematics = False
+drawing_surface = interpolation.Interpolator([[corner[0], corner[1], position] for corner, position in zip(workspace.corners(), corner_positions)])
+right_arm_ik = kinematics.InverseKinematics(right_arm, right_arm_limits.lower[:5], right_arm_limits.upper[:5])
+
+# the left arm's corners, until it has its own calibration: NAO sits in the
+# middle of the card, so they are the mirror image of the right arm's
+left_workspace_corners = [[640 - x, y, kinematics.mirror(angles).tolist()] for x, y, angles in workspace_corners]
+left_workspace = interpolation.Interpolator(left_workspace_corners)
+left_workspace_calibration = "debug/calibration_left.npz"
+if os.path.exists(left_workspace_calibration):
+  left_workspace = interpolation.load_grid(left_workspace_calibration)
+left_corner_positions = left_arm.positions([corner[2] for corner in left_workspace.corners()])
+left_workspace_box = (left_corner_positions.min(axis=0) - WORKSPACE_MARGIN, left_corner_positions.max(axis=0) + WORKSPACE_MARGIN)
+left_drawing_surface = interpolation.Interpolator([[corner[0], corner[1], position] for corner, position in zip(left_workspace.corners(), left_corner_positions)])
+left_arm_ik = kinematics.InverseKinematics(left_arm, left_arm_limits.lower[:5], left_arm_limits.upper[:5])
+
+# split the shapes on a card between both arms and draw with them at once
+use_both_arms = False
+
+# per-pixel joint angle raster baked from the workspace (None to interpolate)
+workspace_raster = None
+if workspace_raster is not None:
+  if os.path.exists(workspace_raster):
+    workspace = interpolation.RasterLookup(workspace_raster)
+  else:
+    workspace = workspace.bake(workspace_raster)
 
 # nao settings
 ip = "169.254.226.148"
@@ -29,32 +83,76 @@ port = 9559
 eyes = None
 video_proxy = None
 video_client = None
-pil_color_space = "RGB"
 resolution = 2   #VGA
 color_space = 11  #RGB
 fps = 30
 
+# write what NAO sees to debug/ (in the background)
+save_debug_images = False
+debug_writer = camera.DebugWriter(save_debug_images)
 
-"""
+# only run full resolution Canny around the shape, found on a smaller frame
+use_roi = False
+roi_tracker = vision.RoiTracker()
+
+# follow the shapes' corners from frame to frame with optical flow, and
+# only run Canny again when they are lost
+track_contours = False
+contour_tracker = vision.ContourTracker()
+
+# work the Canny thresholds out from each frame instead of using 10 and 100
+adaptive_canny = False
+canny_thresholds = vision.AdaptiveThresholds()
+
+# draw straight lines between corners, with a point every few pixels and
+# the pen speeding up and slowing down along each edge, instead of letting
+# the arm swing from corner to corner in joint space
+resample_paths = True
+
+# skip Canny, planning and the lookup table for a card NAO has already seen
+use_shape_cache = False
+shape_cache = vision.ShapeCache()
 
-Connect to NAO Robot on startup
+# seconds NAO takes to raise its hands once the shape is drawn
+RAISE_TIME = 1.0
+
+# save every new card's drawing plan in this directory, named by the card's
+# hash, so it can be replayed later without NAO looking at it (None not to)
+plan_library = None
+
+# trace every lookup_table result and calibration sample (in the background)
+record_lookups = True
+tracer = tracelog.TraceLogger("debug/trace.jsonl")
+
+# makes proxies to NAOqi modules: ALProxy, or FakeNAO.proxy without a robot
+proxy_factory = ALProxy
+modules = ["ALMotion", "ALRobotPosture", "ALTextToSpeech", "ALVideoDevice"]
+pool = None
+motionProxy = None
+postureProxy = None
+voice = None
 
 """
-try:
-  motionProxy = ALProxy("ALMotion", ip, port)
-except Exception, e:
-  print "Could not create proxy to ALMotion"
-  print "Error was: ", e
-try:
-  postureProxy = ALProxy("ALRobotPosture", ip, port)
-except Exception, e:
-  print "Could not create proxy to ALRobotPosture"
-  print "Error was: ", e
-try:
-  voice = ALProxy("ALTextToSpeech", ip, port)
-except Exception, e:
-  print "Could not create proxy to ALTextToSpeech"
-  print "Error was: ", e
+@function: connect
+@description: set up the proxies to NAO's modules, made by make_proxy
+(which takes the same arguments as ALProxy). Swapping in
+fakenao.FakeNAO().proxy runs everything against stand-ins instead of the
+robot. This returns right away: the proxies connect in the background,
+are shared for the whole session and reconnect if the link drops. Raises
+RuntimeError if there is nothing to make proxies with (NAOqi isn't
+installed).
+"""
+def connect(make_proxy=ALProxy):
+  global proxy_factory, pool, motionProxy, postureProxy, voice
+  if make_proxy is None:
+    raise RuntimeError("NAOqi is not installed, run with --fake to use a pretend robot")
+  close_eyes()
+  proxy_factory = make_proxy
+  pool = proxies.ProxyPool(proxy_factory, ip, port)
+  pool.prefetch(modules)
+  motionProxy = pool.proxy("ALMotion")
+  postureProxy = pool.proxy("ALRobotPosture")
+  voice = pool.proxy("ALTextToSpeech")
 
 """
 
@@ -82,6 +180,7 @@ def stiffness_off(proxy):
 @function: bilinear_interpolation
 @description: http://en.wikipedia.org/wiki/Bilinear_interpolation
 """
+@instrument.timed("bilinear_interpolation")
 def bilinear_interpolation(x, y, values):
   # sort values first!
   values = sorted(values)
@@ -129,11 +228,13 @@ def bilinear_interpolation(x, y, values):
 """
 def record_joint_angles():
   # which coordinate location to record
-  input_value = raw_input("\nWhich coordinate? ")
-
-  # read input file
-  f = open('debug/input.txt', 'a')
-  f.write("\n\nCoordinate: " + input_value)
+  input_value = raw_input("\nWhich coordinate? (x, y) ")
+  try:
+    pixel = [float(v) for v in input_value.replace(",", " ").split()]
+  except ValueError:
+    pixel = None
+  if pixel is not None and len(pixel) != 2:
+    pixel = None
 
   #We use the "Body" name to signify the collection of all joints
   pNames = "LArm"
@@ -148,173 +249,263 @@ def record_joint_angles():
   motionProxy.stiffnessInterpolation(pNames, pStiffnessLists, pTimeLists)
 
   # Example that finds the difference between the command and sensed angles.
-  names       = "LArm"
-  useSensors    = False
-  commandAngles = motionProxy.getAngles(names, useSensors)
-
-  f.write("\nLArm:")
-
-  f.write("\nCommand Angles:\n" + str(commandAngles) )
+  for names in ["LArm", "RArm"]:
+    useSensors    = False
+    commandAngles = motionProxy.getAngles(names, useSensors)
+    tracer.log("command", pixel, [commandAngles], names)
 
-  useSensors  = True
-  sensorAngles = motionProxy.getAngles(names, useSensors)
+    useSensors  = True
+    sensorAngles = motionProxy.getAngles(names, useSensors)
+    tracer.log("calibration", pixel, [sensorAngles], names)
 
-  f.write("\nSensor Angles:\n" + str(sensorAngles) )
-
-  f.write("\n\nRArm:")
-
-  # Example that finds the difference between the command and sensed angles.
-  names       = "RArm"
-  useSensors    = False
-  commandAngles = motionProxy.getAngles(names, useSensors)
-
-  f.write("\nCommand Angles:\n" + str(commandAngles) )
-
-  useSensors  = True
-  sensorAngles = motionProxy.getAngles(names, useSensors)
-
-  f.write("\nSensor Angles:\n" + str(sensorAngles) )
-
-  # close input file
-  f.close()
+"""
+@function: record_calibration
+@description: calibrate a whole grid in one go. The arm is moved by hand to
+each grid point in turn, row by row, and held still there for a moment
+while its sensors are read in the background.
+"""
+def record_calibration(effector="RArm"):
+  xs = [int(v) for v in raw_input("\nGrid x coordinates? (e.g. 0 160 320 480 640) ").replace(",", " ").split()]
+  ys = [int(v) for v in raw_input("Grid y coordinates? (e.g. 0 115 230 345 460) ").replace(",", " ").split()]
+
+  # let the arm be moved by hand
+  motionProxy.stiffnessInterpolation(effector, 0.0, 1.0)
+
+  recorder = calibration.CalibrationRecorder(motionProxy, effector).start()
+  raw_input("Hold the arm still for %g seconds at each of the %d points, row by row, then press enter " % (calibration.DWELL_TIME, len(xs) * len(ys)))
+  times, samples = recorder.stop()
+
+  # keep the raw recording whatever happens, so it isn't lost to a miscount
+  path = left_workspace_calibration if effector == "LArm" else workspace_calibration
+  samples_path = os.path.splitext(path)[0] + "_samples.npz"
+  calibration.save_samples(samples_path, times, samples)
+
+  points, spans = calibration.dwells(times, samples)
+  print "Found %d stops in %d samples" % (len(points), len(samples))
+  try:
+    calibration.save_grid(path, xs, ys, points)
+  except ValueError, e:
+    print "Could not save calibration to " + path + " (the recording is in " + samples_path + ")"
+    print "Error was: ", e
+    return
+  print "Saved calibration to " + path
+  set_workspace(interpolation.load_grid(path), effector)
 
 """
 @function: lookup_table
-@description: create lookup table of size 5 by 5 with each coordinate
-containing the joint angles (theta values) to get to that position in
-NAO's workspace.
-@return: a table of joint angles
-"""
-def lookup_table(points):
-  pixel_rows = 640
-  pixel_columns = 460
-  grid = [[0 for x in range(pixel_columns+1)] for x in range(pixel_rows+1)]
-
-  for i in range(0,pixel_rows+1):
-    for j in range(0,pixel_columns+1):
-      if i == 0 and j == 0:
-        grid[i][j] = [0.4188239574432373, 0.3141592741012573, 0.7577540874481201, 0.5660879611968994, 0.5997520685195923, 0.7547999620437622]
-      elif i == 640 and j == 0:
-        grid[i][j] = [0.4970579743385315, -0.3497939705848694, 0.5491300821304321, 1.055433988571167, 0.9909220933914185, 0.7547999620437622]
-      elif i == 0 and j == 460:
-        grid[i][j] = [0.4157559871673584, 0.18710604310035706, 0.10273604094982147, 1.152076005935669, 1.043078064918518, 0.7547999620437622]
-      elif i == 640 and j == 460:
-        grid[i][j] = [0.5216019749641418, -0.6289819478988647, 0.2530680298805237, 1.5446163415908813, 1.0599520206451416, 0.7547999620437622]
-
-  defined_grid_points = [[0, 0, grid[0][0]],
-                         [640, 0, grid[640][0]],
-                         [0, 460, grid[0][460]],
-                         [640, 460, grid[640][460]]]
-
-  # read input file
-  f = open('debug/input.txt', 'a')
-
-  f.write("\n\nTesting")
-
-  # perform bilinear interpolation on all the points
-  # to get theta values of each point
-  path = []
-  go_back_to_start = bilinear_interpolation(points[0][0].item(0), points[0][0].item(1), defined_grid_points)
-  for i in range(len(points)):
-    for j in range(len(points[i])):
-      path.append(bilinear_interpolation(points[i][j].item(0), points[i][j].item(1), defined_grid_points))
-      f.write("\n\n " + str(bilinear_interpolation(points[i][j].item(0), points[i][j].item(1), defined_grid_points)))
-  path.append(go_back_to_start)
+@description: map each point of a contour to the joint angles (theta values)
+that get one of NAO's arms (the right one unless effector says otherwise)
+to that position in its workspace, using the interpolation engine built
+from the corner poses at startup.
+@return: a list of joint angles for each point, ending back at the start
+"""
+@instrument.timed("lookup_table")
+def lookup_table(points, effector="RArm"):
+  arm_workspace, arm, limits, box, surface, ik = arm_model(effector)
 
-  f.close()
+  # perform bilinear interpolation on all the points at once
+  # to get theta values of each point
+  with instrument.span("interpolate"):
+    angles = arm_workspace.map(points)
+
+  # or find where each point is on the drawing surface and solve for it,
+  # keeping the interpolated hand
+  if use_inverse_kinematics:
+    thetas, converged = ik.solve(surface.map(points), angles)
+    if not converged.all():
+      print "Warning: could not reach %d of %d points" % ((~converged).sum(), len(converged))
+    jumps = kinematics.large_steps(thetas)
+    if len(jumps):
+      print "Warning: the arm jumps at %d of %d points" % (len(jumps), len(thetas))
+    angles[:, :thetas.shape[1]] = thetas
+
+  path = angles.tolist()
+  path.append(list(path[0]))
+
+  # trace the pixels and where they took us
+  if record_lookups:
+    tracer.log("lookup_table", points, angles, effector)
 
   return path
 
 """
-@function: robot_vision
-@description: Use NAO's camera to detect the shape to draw. Uses
-PIL at first, then uses Canny Edge Detection via OpenCV.
+@function: set_workspace
+@description: use a calibration grid (from interpolation.load_grid) for
+one arm, along with the workspace box and drawing surface its corners span.
 """
-def robo_vision():
-  # First get an image from Nao, then show it on the screen with PIL.
-  video_proxy = ALProxy("ALVideoDevice", ip, port)
-  video_client = video_proxy.subscribe("NAO_CAM", resolution, color_space, fps)
-
-  # Get a camera image.
-  # image[6] contains the image data passed as an array of ASCII chars.
-  naoImage = video_proxy.getImageRemote(video_client)
+def set_workspace(grid, effector="RArm"):
+  global workspace, workspace_box, drawing_surface, left_workspace, left_workspace_box, left_drawing_surface
+  arm = left_arm if effector == "LArm" else right_arm
+  corners = grid.corners()
+  positions = arm.positions([corner[2] for corner in corners])
+  box = (positions.min(axis=0) - WORKSPACE_MARGIN, positions.max(axis=0) + WORKSPACE_MARGIN)
+  surface = interpolation.Interpolator([[corner[0], corner[1], position] for corner, position in zip(corners, positions)])
+  if effector == "LArm":
+    left_workspace, left_workspace_box, left_drawing_surface = grid, box, surface
+  else:
+    workspace, workspace_box, drawing_surface = grid, box, surface
 
-  # disconect from video_proxy
-  video_proxy.unsubscribe(video_client)
+"""
+@function: arm_model
+@description: everything about one arm that planning needs.
+@return: its workspace mapping, ArmChain, JointLimits, workspace box,
+drawing surface and InverseKinematics
+"""
+def arm_model(effector):
+  if effector == "LArm":
+    return left_workspace, left_arm, left_arm_limits, left_workspace_box, left_drawing_surface, left_arm_ik
+  return workspace, right_arm, right_arm_limits, workspace_box, drawing_surface, right_arm_ik
 
-  # Get the image size and pixel array.
-  imageWidth = naoImage[0]
-  imageHeight = naoImage[1]
-  buffer = naoImage[6]
+"""
+@function: open_eyes
+@description: subscribe to NAO's camera once and keep streaming frames for
+the rest of the session, instead of subscribing for every image. A
+session that gave up on the camera is replaced by a new one.
+@return: the running camera session
+"""
+def open_eyes():
+  global eyes, video_proxy
+  if eyes is not None and eyes.error is not None:
+    close_eyes()
+  if eyes is None:
+    video_proxy = pool.proxy("ALVideoDevice")
+    eyes = camera.CameraSession(video_proxy, resolution, color_space, fps).start()
+  return eyes
 
-  # Create a PIL Image from our pixel array.
-  im = Image.fromstring(pil_color_space, (imageWidth, imageHeight), buffer)
+"""
+@function: close_eyes
+@description: stop streaming and unsubscribe from NAO's camera.
+"""
+def close_eyes():
+  global eyes
+  if eyes is not None:
+    eyes.stop()
+    eyes = None
 
-  # Save the image.
-  im.save("debug/noognagnook_square.png")
+"""
+@function: capture
+@description: get the newest frame from NAO's camera as greyscale. Raises
+IOError if the camera sends nothing for camera.FRAME_TIMEOUT seconds.
+@return: the cropped greyscale frame
+"""
+def capture():
+  # Get the newest camera image from NAO's eyes.
+  # image[6] contains the image data passed as an array of ASCII chars.
+  with instrument.span("capture"):
+    naoImage = open_eyes().latest(camera.FRAME_TIMEOUT)
+  if naoImage is None:
+    raise IOError("no frame from NAO's camera in %.1f s" % camera.FRAME_TIMEOUT)
 
-  # get rid of pink garbage for final canny
-  w, h = im.size
-  im.crop((0, 10, w, h-10)).save("debug/noognagnook_square.png")
+  # Wrap the pixel array as a numpy frame, crop off the pink garbage
+  # and convert to greyscale without touching the disk.
+  gray = camera.grey_frame(naoImage)
 
-  # use opencv to read from image
-  frame = cv2.imread("debug/noognagnook_square.png")
+  # debugging -- write the cropped camera frame to file
+  if debug_writer.enabled:
+    frame = camera.crop_frame(camera.frame_view(naoImage))
+    debug_writer.write("debug/noognagnook_square.png", cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
 
-  # Convert to greyscale
-  gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+  return gray
 
+"""
+@function: edges
+@description: Canny Edge Detection via OpenCV.
+@return: the edge image
+"""
+def edges(gray):
   # Gaussian blur to remove noise
-  blur = cv2.GaussianBlur(gray, (3,3), 0)
+  with instrument.span("blur"):
+    blur = cv2.GaussianBlur(gray, (3,3), 0)
 
   # And do Canny edge detection
-  canny = cv2.Canny(blur, 10, 100)
+  low, high = 10, 100
+  if adaptive_canny:
+    low, high = canny_thresholds.update(blur)
+  with instrument.span("canny"):
+    canny = cv2.Canny(blur, low, high)
 
   # debugging -- write canny to file
-  cv2.imwrite("debug/NAOVISION_square.png", canny)
+  debug_writer.write("debug/NAOVISION_square.png", canny)
+
+  return canny
 
+"""
+@function: find_edges
+@description: edges of the whole frame or, with use_roi, only of the part
+of it where the shape is.
+@return: the edge image and where its top left corner is in the frame
+"""
+def find_edges(gray):
+  if use_roi:
+    roi = roi_tracker.locate(gray)
+    if roi is not None:
+      x0, y0, x1, y1 = roi
+      return edges(gray[y0:y1, x0:x1]), (x0, y0)
+  return edges(gray), (0, 0)
+
+"""
+@function: shapes
+@description: find the contours in an edge image and plan how to draw them.
+offset is where the edge image sits in the frame, so the contours always
+come back in the pixel space lookup_table expects.
+@return: the simplified contours in the order to draw them, and what shape
+each one is
+"""
+def shapes(canny, offset=(0, 0)):
   # contour detection
-  contours,h = cv2.findContours(canny, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+  with instrument.span("findContours"):
+    contours,h = cv2.findContours(canny, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+
+  # simplified and ordered to keep the arm's travel short
+  # http://opencvpython.blogspot.com/2012/06/hi-this-article-is-tutorial-which-try.html
+  # http://docs.opencv.org/modules/imgproc/doc/structural_analysis_and_shape_descriptors.html?highlight=findcontours#findcontours
+  # http://stackoverflow.com/questions/9413216/simple-digit-recognition-ocr-in-opencv-python
+  return planning.plan_contours(contours, classify=vision.classify)
+
+"""
+@function: robot_vision
+@description: Use NAO's camera to detect the shape to draw, using
+Canny Edge Detection via OpenCV, then draw it.
+"""
+def robo_vision():
+  gray = capture()
+  with instrument.span("see_shapes"):
+    polygons, labels, paths = see_shapes(gray)
+  instrument.count("shapes", len(paths))
 
   # Send NAO to Pose Init
   #postureProxy.goToPosture("StandInit", 0.5)
 
-  # NAO, what are we going to draw?
-  voice.say("I will draw your shape!");
+  # NAO, what are we going to draw? (said while the arms get going)
+  intro = robocommands.say(voice, "I will draw your " + (labels[0] if len(labels) == 1 else "shape") + "!")
 
   # debug => turn stiffness off
   #stiffness_off(motionProxy)
 
-  # We will be moving the left arm and right arm
-  motionProxy.setStiffnesses("LArm", 1.0)
-  motionProxy.setStiffnesses("RArm", 1.0)
+  # We will be moving the left arm and right arm, which have to be stiff first
+  robocommands.wait_all(robocommands.stiffen(motionProxy, ["LArm", "RArm"]))
 
-  # draw a specific shape
-  # http://opencvpython.blogspot.com/2012/06/hi-this-article-is-tutorial-which-try.html
-  # http://docs.opencv.org/modules/imgproc/doc/structural_analysis_and_shape_descriptors.html?highlight=findcontours#findcontours
-  # http://stackoverflow.com/questions/9413216/simple-digit-recognition-ocr-in-opencv-python
-  for cnt in contours:
-    approx = cv2.approxPolyDP(cnt,0.1*cv2.arcLength(cnt,True),True)
-    robo_motion(approx)
-    break
+  # draw every shape and wait for the arms to finish
+  with instrument.span("drawing", timeline=True):
+    draw_shapes(polygons, paths)
 
   # cleaner exit
-  effector = ["RArm"]
-  path = [0.39121198654174805, -0.03839196264743805, 0.7132680416107178, 0.9603259563446045, 0.7884340286254883, 0.7547999620437622]
-
-  motionProxy.setAngles(effector, path, 0.3)
+  exit_path = [0.39121198654174805, -0.03839196264743805, 0.7132680416107178, 0.9603259563446045, 0.7884340286254883, 0.7547999620437622]
 
   # raise your hand!
   effectors = ["LArm","RArm"]
   path = [[-1.716588020324707, 0.11500804126262665, -0.1150919571518898, -0.03490658476948738, -1.4542739391326904, 0.7563999891281128],
           [-1.6628141403198242, 0.09506604075431824, 1.1704000234603882, 0.07367396354675293, 0.48470205068588257, 0.7555999755859375]]
 
-  # draw the shape!
-  for i in range(len(path)):
-    motionProxy.setAngles(effectors[i], path[i], 0.2)
-    time.sleep(1)
+  # draw the shape! The left hand goes up while the right arm leaves the
+  # card, then the right hand follows, all while NAO is talking
+  raised = [robocommands.post(motionProxy, "angleInterpolation", effectors[0], [[angle] for angle in path[0]],
+                          [[RAISE_TIME]] * len(path[0]), True),
+            robocommands.post(motionProxy, "angleInterpolation", effectors[1], [list(angles) for angles in zip(exit_path, path[1])],
+                          [[RAISE_TIME, 2 * RAISE_TIME]] * len(path[1]), True)]
 
   # Done
-  voice.say("Here is your shape!")
+  robocommands.wait_all([intro, robocommands.say(voice, "Here is your shape!")] + raised)
 
   """
   c = cv2.waitKey(50)
@@ -323,129 +514,203 @@ def robo_vision():
   """
 
 """
-@function: robo_motion
-@description: draws the shape seen by NAO.
+@function: see_shapes
+@description: the shapes on the card in a frame, what they are and the
+joint paths that draw them. With use_shape_cache, a card that looks like
+one seen before gets the same answer without running Canny or planning.
+@return: the simplified contours, their labels and their joint paths
 """
-def robo_motion(points):
-  # specify the effector to use
-  effector   = "RArm"
+def see_shapes(gray):
+  return plan_shapes(find_shapes(gray))
+
+"""
+@function: find_shapes
+@description: the vision half of see_shapes: the shapes in a frame and
+what they are, or everything including the joint paths when the card is
+in the shape cache. With track_contours, shapes followed from the last
+frame skip Canny. key is the frame's card_key, if it is already known.
+@return: the card_key, contours, labels and joint paths (None if not cached)
+"""
+def find_shapes(gray, key=None):
+  if key is None and (use_shape_cache or plan_library is not None):
+    key = vision.card_key(gray)
+  if use_shape_cache:
+    cached = shape_cache.get(key)
+    if cached is not None:
+      return (key,) + cached
+
+  if track_contours:
+    with instrument.span("opticalFlow"):
+      tracked = contour_tracker.track(gray)
+    if tracked is not None:
+      instrument.count("tracked")
+      return (key,) + tracked + (None,)
+
+  canny, offset = find_edges(gray)
+  polygons, labels = shapes(canny, offset)
+  if track_contours:
+    contour_tracker.start(gray, polygons, labels)
+  return key, polygons, labels, None
+
+"""
+@function: plan_shapes
+@description: the planning half of see_shapes: joint paths for whatever
+find_shapes found, unless it came out of the cache with them.
+@return: the contours, labels and joint paths
+"""
+def plan_shapes(found):
+  key, polygons, labels, paths = found
+  if paths is None:
+    arms = planning.split_arms(polygons) if use_both_arms else ["RArm"] * len(polygons)
+    paths = [plan_path(approx, arm) for approx, arm in zip(polygons, arms)]
+    if use_shape_cache:
+      shape_cache.put(key, polygons, labels, paths)
+    if plan_library is not None:
+      planfile.write_plan(os.path.join(plan_library, "%016x.plan" % key[0]), paths)
+  return polygons, labels, paths
+
+"""
+@function: replay_plan
+@description: draw a plan saved in plan_library (or by batch.py) without
+looking at anything first.
+"""
+def replay_plan(path):
+  plan = planfile.PlanFile(path)
+  robocommands.wait_all(robocommands.stiffen(motionProxy, ["LArm", "RArm"]))
+  drawing = planfile.replay(plan, motionProxy)
+  if drawing is not None:
+    drawing.wait()
+  plan.close()
+
+"""
+@function: robo_pipeline
+@description: keep drawing card after card until cards have been drawn
+(or forever, until Ctrl-C). Capture, vision, planning and motion each run
+on their own thread, connected by short queues, so the next card is seen
+and planned while the arm is still drawing this one. A card is only drawn
+once: frames that look like the last one are skipped.
+@return: the Pipeline, with its counters
+"""
+def robo_pipeline(cards=None):
+  last_seen = [None]
+  drawn = [0]
+  finished = threading.Event()
+
+  def look(gray):
+    key = vision.card_key(gray)
+    if last_seen[0] is not None and vision.same_card(key, last_seen[0]):
+      return None
+    last_seen[0] = key
+    found = find_shapes(gray, key)
+    return found if len(found[1]) else None
+
+  def draw(planned):
+    # cards planned while the last one asked for was being drawn stay undrawn
+    if finished.is_set():
+      return None
+    polygons, labels, paths = planned
+    intro = robocommands.say(voice, "I will draw your " + (labels[0] if len(labels) == 1 else "shape") + "!")
+    draw_shapes(polygons, paths)
+    intro.wait()
+    drawn[0] += 1
+    if cards is not None and drawn[0] >= cards:
+      finished.set()
+    return planned
+
+  robocommands.wait_all(robocommands.stiffen(motionProxy, ["LArm", "RArm"]))
+  runtime = pipeline.Pipeline([
+    pipeline.Stage("capture", capture),
+    pipeline.Stage("vision", look, 1),
+    pipeline.Stage("planning", plan_shapes),
+    pipeline.Stage("motion", draw),
+  ]).start()
+  try:
+    while not finished.wait(1.0) and not runtime.stopping():
+      pass
+  except KeyboardInterrupt:
+    pass
+  runtime.stop()
+  runtime.report()
+  return runtime
+
+"""
+@function: plan_path
+@description: the joint path that draws a shape with one arm, checked
+against its joint limits and workspace. With resample_paths the path is
+dense and comes with its own times, otherwise the arm is timed corner to
+corner.
+@return: a K x 6 array of joint angles, K times from 0 (or None) and the arm
+"""
+def plan_path(points, effector="RArm"):
+  arm_workspace, arm, limits, box, surface, ik = arm_model(effector)
+
+  # a point every few pixels along each edge
+  if resample_paths:
+    points, corners = planning.resample(points)
 
   # create grid with stage 3 setup
-  path = lookup_table(points)
+  path = lookup_table(points, effector)
+
+  # keep every joint inside its limits (to prevent overheating)
+  path, adjusted = limits.clamp(path)
+  if adjusted.any():
+    print "Warning: clamped %d of %d points to the joint limits" % (adjusted.sum(), len(path))
+
+  # make sure every point of the path stays on the drawing surface
+  outside = ~arm.within(path, box[0], box[1])
+  if outside.any():
+    print "Warning: %d of %d points fall outside NAO's workspace" % (outside.sum(), len(path))
+
+  # speed the pen up and down along each edge, as fast as the joints can go
+  times = None
+  if resample_paths:
+    speeds = trajectory.pen_speeds(path, points, corners)
+    times = trajectory.slow_down(path, trajectory.trapezoid_times(points, corners, speeds))
+
+  return path, times, effector
+
+"""
+@function: robo_motion
+@description: draws the shape seen by NAO. The whole path goes to ALMotion
+as one timed trajectory, so this returns as soon as the arm starts moving.
+If the arm is still busy with an earlier drawing (after), the path is
+worked out first and then waits for it.
+@return: a MotionHandle to wait on
+"""
+def robo_motion(points, after=None):
+  return draw_path(plan_path(points), after)
+
+"""
+@function: draw_path
+@description: send a joint path and its times from plan_path to the arm it
+was planned for, once that arm is done with an earlier drawing (after).
+@return: a MotionHandle to wait on
+"""
+def draw_path(planned, after=None):
+  # specify the effector to use
+  path, times, effector = planned
 
   # draw the shape!
-  for i in range(len(path)):
-    motionProxy.setAngles(effector, path[i], 0.2)
-    time.sleep(2)
-
-"""
-@function: transformation
-@description: create a transformation matrix from a given joint angle.
-@return: transformation matrix for given joint.
-"""
-def transformation(name_of_matrix, matrix, rows, columns, a, alpha, distance, theta):
-  temp = 0.0
-  for i in range(rows):
-    for j in range(columns):
-      if i == 0 and j == 0:
-        temp = math.cos(theta*math.pi/180.0)
-        if temp == -0:
-          temp = 0.0
-          matrix[i][j] = round(temp)
-      elif i == 0 and j == 1:
-        temp = (-(math.sin(theta*math.pi/180.0))*math.cos(alpha*math.pi/180.0))
-        if temp == -0:
-          temp = 0.0
-          matrix[i][j] = round(temp)
-      elif i == 0 and j == 2:
-        temp = (math.sin(theta*math.pi/ 180.0) * math.sin(alpha*math.pi/ 180.0))
-        if temp == -0:
-          temp = 0.0
-          matrix[i][j] = round(temp)
-      elif i == 0 and j == 3:
-        temp = (a * math.cos(theta*math.pi/180.0))
-        if temp == -0:
-          temp = 0.0
-          matrix[i][j] = round(temp)
-      elif i == 1 and j == 0:
-        temp = math.sin(theta*math.pi/180.0)
-        if temp == -0:
-          temp = 0.0
-          matrix[i][j] = round(temp)
-      elif i == 1 and j == 1:
-        temp = (math.cos(theta*math.pi/180.0)*math.cos(alpha*math.pi/180.0))
-        if temp == -0:
-          temp = 0.0
-          matrix[i][j] = round(temp)
-      elif i == 1 and j == 2:
-        temp = (-(math.cos(theta*math.pi/180.0))*math.sin(alpha*math.pi/180.0))
-        if temp == -0:
-          temp = 0.0
-          matrix[i][j] = round(temp)
-      elif i == 1 and j == 3:
-        temp = a*math.sin(theta*math.pi/180.0)
-        if temp == -0:
-          temp = 0.0
-          matrix[i][j] = round(temp)
-      elif i == 2 and j == 0:
-        matrix[i][j] = 0.0
-      elif i == 2 and j == 1:
-        temp = math.sin(alpha * math.pi/180.0)
-        if temp == -0:
-          temp = 0.0
-          matrix[i][j] = round(temp)
-      elif i == 2 and j == 2:
-        temp = math.cos(alpha * math.pi/180.0)
-        if temp == -0:
-          temp = 0.0
-          matrix[i][j] = round(temp)
-      elif i == 2 and j == 3:
-        temp = distance
-        if temp == -0:
-          temp = 0.0
-          matrix[i][j] = round(temp)
-      elif i == 3 and j == 0:
-        matrix[i][j] = 0.0
-      elif i == 3 and j == 1:
-        matrix[i][j] = 0.0
-      elif i == 3 and j == 2:
-        matrix[i][j] = 0.0
-      elif i == 3 and j == 3:
-        matrix[i][j] = 1.0
-  return matrix
-
-"""
-@function: multiply_matrices
-@description: Multiply the joints together to get end effector.
-@return: end effector.
-"""
-def multiply_matrices(RShoulderPitch, RShoulderRoll, RElbowYaw, RElbowRoll, RWristYaw):
-  # initialize temp matrices
-    m0 = [[0 for x in range(4)] for x in range(4)]
-    m1 = [[0 for x in range(4)] for x in range(4)]
-    m2 = [[0 for x in range(4)] for x in range(4)]
-    m3 = [[0 for x in range(4)] for x in range(4)]
-
-    for i in range(rows):
-      for j in range(columns):
-        for inner in range(4):
-          m0[i][j] = round(m0[i][j]+RShoulderPitch[i][inner]*RShoulderRoll[inner][j])
-
-    for i in range(rows):
-      for j in range(columns):
-        for inner in range(4):
-          m1[i][j] = round(m1[i][j]+m0[i][inner]*RElbowYaw[inner][j])
-
-    for i in range(rows):
-      for j in range(columns):
-        for inner in range(4):
-          m2[i][j] = round(m2[i][j]+m1[i][inner]*RElbowRoll[inner][j])
-
-    for i in range(rows):
-      for j in range(columns):
-        for inner in range(4):
-          m3[i][j] = round(m3[i][j]+m2[i][inner]*RWristYaw[inner][j])
-    return m3
+  if after is not None:
+    after.wait()
+  return trajectory.TrajectoryExecutor(motionProxy, effector).execute(path, times=times)
+
+"""
+@function: draw_shapes
+@description: draw the planned paths of every shape on a card and wait
+until they are done: one after the other, or with both arms at once when
+they were planned for both.
+"""
+def draw_shapes(polygons, paths):
+  if len(set(planned[2] for planned in paths)) > 1:
+    scheduler.ArmScheduler(motionProxy).run(zip(polygons, paths))
+    return
+
+  drawing = None
+  for planned in paths:
+    drawing = draw_path(planned, drawing)
+  if drawing is not None:
+    drawing.wait()
 
 """
 @function: transformation_matrices
@@ -453,9 +718,6 @@ def multiply_matrices(RShoulderPitch, RShoulderRoll, RElbowYaw, RElbowRoll, RWri
 @return: a final transformation matrix (end effector)
 """
 def transformation_matrices(list_of_thetas):
-  rows = 4
-  columns = 4
-
   # get theta values from the list
   theta0 = list_of_thetas[0]
   theta1 = list_of_thetas[1]
@@ -463,77 +725,78 @@ def transformation_matrices(list_of_thetas):
   theta3 = list_of_thetas[3]
   theta4 = list_of_thetas[4]
 
-  # initialize transformation matrices
-  RShoulderPitch = [[0 for x in range(rows)] for x in range(columns)]
-  RShoulderRoll = [[0 for x in range(rows)] for x in range(columns)]
-  RElbowYaw = [[0 for x in range(rows)] for x in range(columns)]
-  RElbowRoll = [[0 for x in range(rows)] for x in range(columns)]
-  RWristYaw = [[0 for x in range(rows)] for x in range(columns)]
-  base_to_start = [[0 for x in range(rows)] for x in range(columns)]
-
   # bounds checking (to prevent overheating)
   print "(Before check): Thetas are %d, %d, %d, %d, %d" % (float(theta0), float(theta1), float(theta2), float(theta3), float(theta4))
 
-  if float(theta0) >= 119.5:
-    theta0 = 110
-  elif float(theta0) <= -119.5:
-    theta0 = -110
-  elif float(theta1) > 18.0:
-    theta1 = 15
-  elif float(theta1) < -76:
-    theta1 = -70
-  elif float(theta2) >= 119.5:
-    theta2 = 110
-  elif float(theta2) <= -119.5:
-    theta2 = -110
-  elif float(theta3) >= 88.5:
-    theta3 = 80
-  elif float(theta3) <= 2:
-    theta3 = 5
-  elif float(theta4) >= 104.5:
-    theta4 = 100
-  elif float(theta4) <= -104.5:
-    theta4 = -100
-  else:
+  thetas, adjusted = right_arm_limits.clamp(np.radians([[float(theta0), float(theta1), float(theta2), float(theta3), float(theta4)]]))
+  if not adjusted.any():
     print "no issues!"
+  theta0, theta1, theta2, theta3, theta4 = np.degrees(thetas[0])
 
   print "\n(After check): Thetas are %d, %d, %d, %d, %d" % (float(theta0), float(theta1), float(theta2), float(theta3), float(theta4))
 
   # transformation matrices
-  RShoulderPitch = transformation("RShoulderPitch",RShoulderPitch,rows,columns,0,-(math.pi/2.0), 0, float(theta0))
-  RShoulderRoll = transformation("RShoulderRoll",RShoulderRoll,rows,columns,0,math.pi/2.0, 0, float(theta1) + (math.pi/2.0))
-  RElbowYaw = transformation("RElbowYaw",RElbowYaw,rows,columns,-ELBOW_OFFSET_Y, (math.pi / 2.0), UPPER_ARM_LENGTH, float(theta2))
-  RElbowRoll = transformation("RElbowRoll",RElbowRoll,rows,columns,0, -(math.pi / 2.0), 0, float(theta3))
-  RWristYaw = transformation("RWristYaw",RWristYaw,rows,columns,LOWER_ARM_LENGTH, (math.pi/ 2.0), 0, float(theta4))
-  RHand = transformation("RHand",RHand,rows,columns,LOWER_ARM_LENGTH, (math.pi/ 2.0), 0, float(theta4))
-  base_to_start = multiply_matrices(RShoulderPitch,RShoulderRoll,RElbowYaw,RElbowRoll,RWristYaw,RHand)
+  joints = right_arm.joint_transforms(thetas)[0]
+  base_to_start = right_arm.transforms(thetas)[0]
 
   # pretty print each transformation
-  pretty_print("RShoulderPitch", RShoulderPitch)
-  pretty_print("RShoulderRoll", RShoulderRoll)
-  pretty_print("RElbowYaw", RElbowYaw)
-  pretty_print("RElbowRoll", RElbowRoll)
-  pretty_print("RWristRoll", RWristRoll)
-  pretty_print("RWristRoll", RWristRoll)
-  pretty_print("base_to_start", base_to_start)
+  for name, matrix in zip(right_arm.names, joints):
+    pretty_print(name, matrix.round(3).tolist())
+  pretty_print("base_to_start", base_to_start.round(3).tolist())
 
   return base_to_start
 
 if __name__ == '__main__':
+  # connect to NAO (importing CannyBot doesn't, so fleet.py, batch.py and
+  # benchmark.py connect to what they want, or to nothing at all)
+  try:
+    if "--fake" in sys.argv:
+      connect(fakenao.FakeNAO().proxy)
+    else:
+      connect(ALProxy)
+  except RuntimeError, e:
+    print "Could not connect to NAO"
+    print "Error was: ", e
+    sys.exit(1)
+
+  # run with --timings to see where the time went when the program ends
+  if "--timings" in sys.argv:
+    instrument.instruments.enable("debug/timings.json")
+
+  # run with --timeline to see what NAO was saying and doing when, and how
+  # much overlapping it saved
+  if "--timeline" in sys.argv:
+    instrument.instruments.enable_timeline("debug/timeline.json")
+
   print("\nWelcome to the CannyBot Program!\n")
 
+  # run python CannyBot.py --fake to use a pretend robot (and --timings to time it)
   # debug?
-  decision = raw_input("\nWould you like to debug? (0 or 1)\n> ")
+  decision = raw_input("\nWould you like to debug? (0, 1, 2 or 4 to calibrate the right or left arm's grid, 3 to keep drawing or 5 to replay a plan)\n> ")
   if decision == "0":
     robo_vision()
+  elif decision == "2":
+    record_calibration()
+  elif decision == "3":
+    robo_pipeline()
+  elif decision == "4":
+    record_calibration("LArm")
+  elif decision == "5":
+    replay_plan(raw_input("Plan file? "))
   else:
     record_joint_angles()
 
   # tron reference!
-  voice.say("End of line.")
+  goodbye = robocommands.say(voice, "End of line.")
+
+  # unsubscribe from the camera and let any debug images and traces finish
+  # writing while NAO is still talking
+  close_eyes()
+  debug_writer.flush()
+  tracer.flush()
 
   # smooth transition ftw!
-  time.sleep(3)
+  goodbye.wait()
 
   # end of program
   print("End of Program.")
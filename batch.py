@@ -0,0 +1,139 @@
+"""
+@file: batch.py
+@authors: Tommy Lin, TJ Maynes
+@subject: turning a folder of drawings into drawing plans ahead of time, on every core.
+"""
+
+import os, sys, glob, time, json, multiprocessing
+import cv2
+
+"""
+
+global variables
+
+"""
+# where plans go unless told otherwise
+OUTPUT_DIRECTORY = "debug/plans"
+
+# images handed to a worker at a time
+CHUNK_SIZE = 4
+
+"""
+@function: images
+@description: the image files in a directory, or matching a glob.
+@return: a sorted list of paths
+"""
+def images(pattern):
+  if os.path.isdir(pattern):
+    pattern = os.path.join(pattern, "*.png")
+  return sorted(glob.glob(pattern))
+
+def _start_worker():
+  # every worker has its own CannyBot, not connected to any robot, with
+  # nothing carried over from one customer's drawing to the next
+  import CannyBot
+  CannyBot.use_shape_cache = False
+  CannyBot.record_lookups = False
+
+"""
+@function: plan_image
+@description: fit one image to the workspace (see camera.fit_frame), run
+it through blur, Canny, findContours, approxPolyDP and the pixel to joint
+mapping, and save the plan next to the others in output as a plan file,
+<image name>.plan.
+@return: a dict summing the plan up: "image", "plan", "shapes", "labels",
+"points", "outside" (points beyond the workspace), "seconds" (to draw)
+and "error" (None if it worked)
+"""
+def plan_image(job):
+  path, output = job
+  import CannyBot, planfile, camera
+  summary = {"image": path, "plan": None, "shapes": 0, "labels": [], "points": 0,
+             "outside": 0, "seconds": 0.0, "error": None}
+  try:
+    image = cv2.imread(path)
+    if image is None:
+      raise IOError("could not read " + path)
+    corners = CannyBot.workspace.corners()
+    width = int(max(corner[0] for corner in corners))
+    height = int(max(corner[1] for corner in corners))
+    gray = camera.fit_frame(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), width, height)
+    CannyBot.roi_tracker.reset()
+    CannyBot.contour_tracker.reset()
+    CannyBot.canny_thresholds.reset()
+
+    key, polygons, labels, paths = CannyBot.find_shapes(gray)
+    polygons, labels, paths = CannyBot.plan_shapes((key, polygons, labels, paths))
+
+    for joints, times, effector in paths:
+      arm_workspace, arm, limits, box, surface, ik = CannyBot.arm_model(effector)
+      if times is not None:
+        summary["seconds"] += float(times[-1])
+      summary["points"] += len(joints)
+      summary["outside"] += int((~arm.within(joints, box[0], box[1])).sum())
+
+    summary["plan"] = os.path.join(output, os.path.splitext(os.path.basename(path))[0] + ".plan")
+    planfile.write_plan(summary["plan"], paths)
+    summary["shapes"] = len(polygons)
+    summary["labels"] = labels
+  except Exception, e:
+    summary["error"] = str(e)
+  return summary
+
+"""
+@function: run
+@description: plan every image on a pool of processes (one per core by
+default). Each summary is written to output/index.jsonl as soon as its
+image is done, whatever order they finish in.
+@return: the summaries and how many seconds it all took
+"""
+def run(paths, output=OUTPUT_DIRECTORY, processes=None, verbose=True):
+  if not os.path.isdir(output):
+    os.makedirs(output)
+  index = open(os.path.join(output, "index.jsonl"), 'w')
+  workers = multiprocessing.Pool(processes, _start_worker)
+  summaries = []
+  started = time.time()
+  try:
+    for summary in workers.imap_unordered(plan_image, [(path, output) for path in paths], CHUNK_SIZE):
+      summaries.append(summary)
+      index.write(json.dumps(summary) + "\n")
+      index.flush()
+      if verbose and summary["error"] is not None:
+        print "Could not plan " + summary["image"]
+        print "Error was: ", summary["error"]
+  finally:
+    workers.close()
+    workers.join()
+    index.close()
+  return summaries, time.time() - started
+
+"""
+@function: report
+@description: print what came out of a batch and how fast it went.
+"""
+def report(summaries, seconds):
+  planned = [s for s in summaries if s["error"] is None]
+  empty = [s for s in planned if s["shapes"] == 0]
+  outside = [s for s in planned if s["outside"]]
+  print "%d images in %.2f s (%.2f per second)" % (len(summaries), seconds, len(summaries) / max(seconds, 1e-9))
+  print "%d planned, %d failed, %d with no shapes, %d reaching outside the workspace" % (
+    len(planned), len(summaries) - len(planned), len(empty), len(outside))
+  for s in empty + outside:
+    print "  check " + s["image"]
+
+if __name__ == '__main__':
+  # python batch.py [--processes N] [--output DIR] directory-or-glob ...
+  args = sys.argv[1:]
+  processes = None
+  output = OUTPUT_DIRECTORY
+  if "--processes" in args:
+    at = args.index("--processes")
+    processes = int(args[at + 1])
+    del args[at:at + 2]
+  if "--output" in args:
+    at = args.index("--output")
+    output = args[at + 1]
+    del args[at:at + 2]
+  paths = [path for pattern in args or ["debug"] for path in images(pattern)]
+  report(*run(paths, output, processes))
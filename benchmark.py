@@ -0,0 +1,432 @@
+"""
+@file: benchmark.py
+@authors: Tommy Lin, TJ Maynes
+@subject: timing every stage of CannyBot's drawing cycle against a pretend NAO.
+"""
+
+import sys, time
+import numpy as np
+import cv2
+import CannyBot, fakenao, camera, vision, planning, robocommands, instrument
+
+"""
+
+global variables
+
+"""
+STAGES = ["capture", "canny", "contours", "lookup_table", "robo_motion"]
+PERCENTILES = [50, 90, 99]
+
+# seconds a real NAO takes to say a word, before time_scale
+SPEAKING_TIME = 0.35
+
+"""
+@function: run
+@description: run the capture -> Canny -> contour -> lookup_table ->
+robo_motion cycle cycles times against a FakeNAO replaying images.
+@return: a dict of stage name to a list of seconds, one per cycle
+"""
+def run(cycles=100, images=None, time_scale=0.0):
+  nao = fakenao.FakeNAO(images, time_scale)
+  CannyBot.connect(nao.proxy)
+  CannyBot.record_lookups = False
+
+  timings = dict((stage, []) for stage in STAGES)
+  try:
+    for cycle in range(cycles):
+      started = time.time()
+      gray = CannyBot.capture()
+      captured = time.time()
+      canny, offset = CannyBot.find_edges(gray)
+      detected = time.time()
+      polygons, labels = CannyBot.shapes(canny, offset)
+      planned = time.time()
+
+      paths = [CannyBot.plan_path(points) for points in polygons]
+      looked_up = time.time()
+
+      drawing = None
+      for path in paths:
+        if drawing is not None:
+          drawing.wait()
+        drawing = CannyBot.draw_path(path)
+      if drawing is not None:
+        drawing.wait()
+      drawn = time.time()
+
+      timings["capture"].append(captured - started)
+      timings["canny"].append(detected - captured)
+      timings["contours"].append(planned - detected)
+      timings["lookup_table"].append(looked_up - planned)
+      timings["robo_motion"].append(drawn - looked_up)
+  finally:
+    CannyBot.close_eyes()
+  return timings
+
+"""
+@function: report
+@description: print latency percentiles for each stage in milliseconds.
+"""
+def report(timings):
+  print "%-14s %8s" % ("stage", "cycles") + "".join("%9s" % ("p%d" % p) for p in PERCENTILES) + "%9s" % "max"
+  for stage in STAGES:
+    ms = np.array(timings[stage]) * 1000.0
+    print "%-14s %8d" % (stage, len(ms)) + "".join("%9.2f" % v for v in np.percentile(ms, PERCENTILES)) + "%9.2f" % ms.max()
+  total = np.sum([timings[stage] for stage in STAGES], axis=0) * 1000.0
+  print "%-14s %8d" % ("total", len(total)) + "".join("%9.2f" % v for v in np.percentile(total, PERCENTILES)) + "%9.2f" % total.max()
+
+"""
+@function: compare_roi
+@description: time the vision stages (Canny plus contours) per frame with
+and without the region of interest, over each image on its own.
+"""
+def compare_roi(cycles=100, images=None):
+  video = fakenao.FakeNAO(images).proxy("ALVideoDevice")
+  client = video.subscribe("benchmark", CannyBot.resolution, CannyBot.color_space, CannyBot.fps)
+  frames = [camera.grey_frame(video.getImageRemote(client)) for image in video.images]
+  use_roi = CannyBot.use_roi
+  print "%-8s %12s %12s %12s %12s" % ("image", "full (ms)", "roi (ms)", "full shapes", "roi shapes")
+  try:
+    for number, gray in enumerate(frames):
+      results = []
+      for mode in [False, True]:
+        CannyBot.use_roi = mode
+        CannyBot.roi_tracker.reset()
+        started = time.time()
+        for cycle in range(cycles):
+          polygons, labels = CannyBot.shapes(*CannyBot.find_edges(gray))
+        results.append(((time.time() - started) / cycles * 1000.0, len(polygons)))
+      print "%-8d %12.2f %12.2f %12d %12d" % (number, results[0][0], results[1][0], results[0][1], results[1][1])
+  finally:
+    CannyBot.use_roi = use_roi
+
+"""
+@function: compare_canny
+@description: contour counts and per-frame vision time with the fixed
+Canny thresholds against adaptive ones, over each image under dimmer and
+brighter lighting.
+"""
+def compare_canny(cycles=100, images=None, gains=(0.3, 0.6, 1.0, 1.6)):
+  video = fakenao.FakeNAO(images).proxy("ALVideoDevice")
+  client = video.subscribe("benchmark", CannyBot.resolution, CannyBot.color_space, CannyBot.fps)
+  frames = [camera.grey_frame(video.getImageRemote(client)) for image in video.images]
+  adaptive = CannyBot.adaptive_canny
+  print "%-6s %5s %10s %10s %12s %12s %12s" % ("image", "gain", "fixed (ms)", "adapt (ms)", "fixed conts", "adapt conts", "thresholds")
+  try:
+    for number, frame in enumerate(frames):
+      for gain in gains:
+        gray = np.clip(frame * gain, 0, 255).astype(np.uint8)
+        results = []
+        for mode in [False, True]:
+          CannyBot.adaptive_canny = mode
+          CannyBot.canny_thresholds.reset()
+          started = time.time()
+          for cycle in range(cycles):
+            canny = CannyBot.edges(gray)
+            contours, h = cv2.findContours(canny, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+          results.append(((time.time() - started) / cycles * 1000.0, len(contours)))
+        low, high = CannyBot.canny_thresholds.low, CannyBot.canny_thresholds.high
+        print "%-6d %5.1f %10.2f %10.2f %12d %12d %12s" % (number, gain, results[0][0], results[1][0], results[0][1], results[1][1], "%d/%d" % (low, high))
+  finally:
+    CannyBot.adaptive_canny = adaptive
+
+"""
+@function: compare_cache
+@description: time working out the shapes and joint paths for a card held
+up again and again (each frame with a little camera noise), with and
+without the shape cache.
+"""
+def compare_cache(cycles=100, images=None, noise=2.0):
+  nao = fakenao.FakeNAO(images)
+  CannyBot.connect(nao.proxy)
+  CannyBot.record_lookups = False
+  video = nao.proxy("ALVideoDevice")
+  client = video.subscribe("benchmark", CannyBot.resolution, CannyBot.color_space, CannyBot.fps)
+  frames = [camera.grey_frame(video.getImageRemote(client)) for image in video.images]
+  random = np.random.RandomState(0)
+  cached = CannyBot.use_shape_cache
+  print "%-8s %12s %12s %10s %12s" % ("image", "plain (ms)", "cached (ms)", "hit rate", "shapes")
+  try:
+    for number, frame in enumerate(frames):
+      noisy = [np.clip(frame + random.randn(*frame.shape) * noise, 0, 255).astype(np.uint8) for cycle in range(cycles)]
+      results = []
+      for mode in [False, True]:
+        CannyBot.use_shape_cache = mode
+        CannyBot.shape_cache = vision.ShapeCache()
+        started = time.time()
+        for gray in noisy:
+          polygons, labels, paths = CannyBot.see_shapes(gray)
+        results.append(((time.time() - started) / cycles * 1000.0, len(paths)))
+      print "%-8d %12.2f %12.2f %9.0f%% %12s" % (number, results[0][0], results[1][0],
+                                                100.0 * CannyBot.shape_cache.hits / cycles, "%d/%d" % (results[0][1], results[1][1]))
+  finally:
+    CannyBot.use_shape_cache = cached
+    CannyBot.close_eyes()
+
+"""
+@function: compare_pipeline
+@description: time drawing cards one after another (see the card, plan
+it, draw it, repeat) against robo_pipeline, which sees and plans the next
+card while the arm draws. time_scale sets how long the pretend arm takes.
+"""
+def compare_pipeline(cards=20, images=None, time_scale=0.1):
+  nao = fakenao.FakeNAO(images, time_scale)
+  CannyBot.connect(nao.proxy)
+  CannyBot.record_lookups = False
+  cached = CannyBot.use_shape_cache
+  CannyBot.use_shape_cache = False
+  try:
+    started = time.time()
+    for card in range(cards):
+      polygons, labels, paths = CannyBot.see_shapes(CannyBot.capture())
+      drawing = None
+      for path in paths:
+        drawing = CannyBot.draw_path(path, drawing)
+      if drawing is not None:
+        drawing.wait()
+    sequential = time.time() - started
+
+    started = time.time()
+    runtime = CannyBot.robo_pipeline(cards)
+    pipelined = time.time() - started
+    print "one at a time: %.2f cards per second, pipelined: %.2f cards per second" % (
+      cards / sequential, runtime.throughput()[0] / pipelined)
+  finally:
+    CannyBot.use_shape_cache = cached
+    CannyBot.close_eyes()
+
+"""
+@function: swing
+@description: how far (radians, worst joint) the arm strays from the
+drawn outline of polygon when it moves in straight joint space lines
+between keyframes (N x 2 pixels, in order around the outline).
+@return: the largest error
+"""
+def swing(polygon, keyframes):
+  dense, corners = planning.resample(polygon, 1)
+  truth = CannyBot.workspace.map(dense)
+  keyframes = np.vstack([keyframes, keyframes[:1]])
+  dense = np.vstack([dense, dense[:1]])
+  along = lambda points: np.concatenate([[0.0], np.cumsum(np.sqrt((np.diff(points, axis=0) ** 2).sum(axis=1)))])
+  joints = CannyBot.workspace.map(keyframes)
+  arm = np.column_stack([np.interp(along(dense)[:-1], along(keyframes), joints[:, j]) for j in range(joints.shape[1])])
+  return np.abs(arm - truth).max()
+
+"""
+@function: compare_paths
+@description: drawing each shape corner to corner against resampled and
+speed profiled: how long the arm takes, how far it strays from the
+outline and how long planning takes.
+"""
+def compare_paths(cycles=100, images=None):
+  video = fakenao.FakeNAO(images).proxy("ALVideoDevice")
+  client = video.subscribe("benchmark", CannyBot.resolution, CannyBot.color_space, CannyBot.fps)
+  frames = [camera.grey_frame(video.getImageRemote(client)) for image in video.images]
+  resample = CannyBot.resample_paths
+  CannyBot.record_lookups = False
+  print "%-6s %6s %8s %12s %12s %12s %12s %10s" % ("image", "shape", "points", "corners (s)", "profile (s)",
+                                                   "corners err", "profile err", "plan (ms)")
+  try:
+    for number, gray in enumerate(frames):
+      for index, polygon in enumerate(CannyBot.shapes(*CannyBot.find_edges(gray))[0]):
+        results = []
+        for mode in [False, True]:
+          CannyBot.resample_paths = mode
+          started = time.time()
+          for cycle in range(cycles):
+            path, times, effector = CannyBot.plan_path(polygon)
+          planned = (time.time() - started) / cycles * 1000.0
+          if times is None:
+            times = CannyBot.trajectory.path_times(path)
+          results.append((len(path), times[-1], planned))
+        resampled = planning.resample(polygon)[0]
+        print "%-6d %6d %8d %12.2f %12.2f %12.4f %12.4f %10.2f" % (number, index, results[1][0], results[0][1], results[1][1],
+                                                                  swing(polygon, polygon.reshape(-1, 2)), swing(polygon, resampled), results[1][2])
+  finally:
+    CannyBot.resample_paths = resample
+
+"""
+@function: compare_arms
+@description: time drawing every shape on each image with the right arm
+alone against both arms at once. time_scale sets how long the pretend
+arms take.
+"""
+def compare_arms(cycles=1, images=None, time_scale=0.1):
+  nao = fakenao.FakeNAO(images, time_scale)
+  CannyBot.connect(nao.proxy)
+  CannyBot.record_lookups = False
+  video = nao.proxy("ALVideoDevice")
+  client = video.subscribe("benchmark", CannyBot.resolution, CannyBot.color_space, CannyBot.fps)
+  frames = [camera.grey_frame(video.getImageRemote(client)) for image in video.images]
+  both = CannyBot.use_both_arms
+  print "%-6s %7s %12s %12s %8s" % ("image", "shapes", "one arm (s)", "both (s)", "split")
+  try:
+    for number, gray in enumerate(frames):
+      results = []
+      for mode in [False, True]:
+        CannyBot.use_both_arms = mode
+        CannyBot.shape_cache.clear()
+        polygons, labels, paths = CannyBot.plan_shapes(CannyBot.find_shapes(gray))
+        started = time.time()
+        for cycle in range(cycles):
+          CannyBot.draw_shapes(polygons, paths)
+        results.append((time.time() - started) / cycles)
+      arms = [planned[2] for planned in paths]
+      print "%-6d %7d %12.2f %12.2f %8s" % (number, len(polygons), results[0], results[1],
+                                            "%d/%d" % (arms.count("LArm"), arms.count("RArm")))
+  finally:
+    CannyBot.use_both_arms = both
+    CannyBot.close_eyes()
+
+"""
+@function: compare_speech
+@description: time robo_vision's whole cycle, talking and raising its
+hands included, with every command waited for in turn against posting
+them so they overlap. time_scale sets how long the pretend NAO takes to
+move and talk.
+"""
+def compare_speech(cycles=3, images=None, time_scale=0.1):
+  nao = fakenao.FakeNAO(images, time_scale, SPEAKING_TIME * time_scale)
+  CannyBot.connect(nao.proxy)
+  CannyBot.record_lookups = False
+  overlap = robocommands.overlap
+  instruments = instrument.instruments
+  enabled, timeline = instruments.enabled, instruments.timeline
+  instruments.enable_timeline()
+  print "%-10s %10s %14s %12s %10s" % ("commands", "cycle (s)", "one by one (s)", "timeline (s)", "saved (s)")
+  try:
+    for mode in [False, True]:
+      robocommands.overlap = mode
+      seconds = []
+      for cycle in range(cycles):
+        instruments.clear_timeline()
+        started = time.time()
+        CannyBot.robo_vision()
+        seconds.append(time.time() - started)
+      serial, wall = instruments.overlap()
+      print "%-10s %10.2f %14.2f %12.2f %10.2f" % ("posted" if mode else "blocking", np.mean(seconds), serial, wall, serial - wall)
+    print
+    instruments.report_timeline()
+  finally:
+    robocommands.overlap = overlap
+    instruments.enabled, instruments.timeline = enabled, timeline
+    CannyBot.close_eyes()
+
+"""
+@function: moving_shapes
+@description: a made up sequence of frames of a shape outlined on a white
+card, drifting step pixels and turning turn degrees a frame (and, with
+jump, leaping across the card a third of the way through), with a little
+camera noise.
+@return: the grey frames and, for each, the shape's true outline (K x 2)
+"""
+def moving_shapes(frames, shape="square", step=(3, 2), turn=0.5, jump=False, size=(480, 640), noise=2.0, seed=0):
+  if shape == "circle":
+    outline = cv2.ellipse2Poly((0, 0), (60, 60), 0, 0, 360, 5).astype(np.float64)
+  else:
+    corners = 3 if shape == "triangle" else 4
+    angles = np.arange(corners) * 2 * np.pi / corners + np.pi / 4
+    outline = 70 * np.column_stack([np.cos(angles), np.sin(angles)])
+  random = np.random.RandomState(seed)
+  start = np.array([size[1] * 0.3, size[0] * 0.35])
+  sequence = []
+  outlines = []
+  for frame in range(frames):
+    centre = start + frame * np.asarray(step, dtype=np.float64)
+    if jump and frame >= frames // 3:
+      centre += (size[1] * 0.3, size[0] * 0.2)
+    a = np.radians(turn * frame)
+    points = outline.dot([[np.cos(a), np.sin(a)], [-np.sin(a), np.cos(a)]]) + centre
+    card = np.full(size, 255.0)
+    card = cv2.polylines(card, [np.round(points).astype(np.int32)], True, 0, 3)
+    card += random.normal(0, noise, size)
+    sequence.append(np.clip(card, 0, 255).astype(np.uint8))
+    outlines.append(points.astype(np.float32))
+  return sequence, outlines
+
+"""
+@function: compare_tracking
+@description: vision time per frame, and how far the corners found are
+from the true outline, re-detecting every frame with Canny against
+following the corners with optical flow, over made up moving shapes.
+"""
+def compare_tracking(frames=60):
+  sequences = [
+    ("square", moving_shapes(frames, "square")),
+    ("triangle", moving_shapes(frames, "triangle")),
+    ("circle", moving_shapes(frames, "circle")),
+    ("fast square", moving_shapes(frames, "square", step=(5, 3), turn=1.5)),
+    ("jumping", moving_shapes(frames, "square", jump=True)),
+    ("square 2x", moving_shapes(frames, "square", size=(960, 1280))),
+  ]
+  cache = CannyBot.use_shape_cache
+  track = CannyBot.track_contours
+  CannyBot.use_shape_cache = False
+  print "%-12s %10s %10s %9s %10s %10s %10s" % ("sequence", "canny (ms)", "flow (ms)", "tracked", "shapes",
+                                               "canny err", "flow err")
+  try:
+    for name, (sequence, outlines) in sequences:
+      results = []
+      for mode in [False, True]:
+        CannyBot.track_contours = mode
+        CannyBot.contour_tracker = vision.ContourTracker()
+        seconds = []
+        errors = []
+        shapes = []
+        for gray, outline in zip(sequence, outlines):
+          started = time.time()
+          key, polygons, labels, paths = CannyBot.find_shapes(gray)
+          seconds.append(time.time() - started)
+          shapes.append(len(polygons))
+          corners = [tuple(map(float, corner)) for polygon in polygons for corner in np.reshape(polygon, (-1, 2))]
+          errors.append(max([abs(cv2.pointPolygonTest(outline, corner, True)) for corner in corners] or [np.nan]))
+        results.append((np.mean(seconds) * 1000.0, np.nanmean(errors), np.mean(shapes), CannyBot.contour_tracker.tracked))
+      print "%-12s %10.2f %10.2f %9s %10s %10.2f %10.2f" % (name, results[0][0], results[1][0], "%d/%d" % (results[1][3], frames),
+                                                         "%.1f/%.1f" % (results[0][2], results[1][2]), results[0][1], results[1][1])
+  finally:
+    CannyBot.use_shape_cache = cache
+    CannyBot.track_contours = track
+    CannyBot.contour_tracker = vision.ContourTracker()
+
+if __name__ == '__main__':
+  # python benchmark.py [--roi] [--timings] [cycles] [images...]
+  # python benchmark.py compare-roi [cycles] [images...]
+  # python benchmark.py compare-canny [cycles] [images...]
+  # python benchmark.py compare-cache [cycles] [images...]
+  # python benchmark.py compare-pipeline [cards] [images...]
+  # python benchmark.py compare-paths [cycles] [images...]
+  # python benchmark.py compare-arms [cycles] [images...]
+  # python benchmark.py compare-speech [cycles] [images...]
+  # python benchmark.py compare-tracking [frames]
+  args = sys.argv[1:]
+  compare = None
+  if args[:1] in (["compare-roi"], ["compare-canny"], ["compare-cache"], ["compare-pipeline"], ["compare-paths"], ["compare-arms"], ["compare-speech"], ["compare-tracking"]):
+    compare = args.pop(0)
+  if "--roi" in args:
+    args.remove("--roi")
+    CannyBot.use_roi = True
+
+  # see where the time went when the benchmark ends
+  if "--timings" in args:
+    args.remove("--timings")
+    instrument.instruments.enable("debug/timings.json")
+  cycles = int(args[0]) if args else 100
+  images = args[1:] or None
+  if compare == "compare-roi":
+    compare_roi(cycles, images)
+  elif compare == "compare-canny":
+    compare_canny(cycles, images)
+  elif compare == "compare-cache":
+    compare_cache(cycles, images)
+  elif compare == "compare-pipeline":
+    compare_pipeline(cycles, images)
+  elif compare == "compare-paths":
+    compare_paths(cycles, images)
+  elif compare == "compare-arms":
+    compare_arms(cycles, images)
+  elif compare == "compare-speech":
+    compare_speech(cycles, images)
+  elif compare == "compare-tracking":
+    compare_tracking(cycles)
+  else:
+    report(run(cycles, images))
@@ -0,0 +1,137 @@
+"""
+@file: calibration.py
+@authors: Tommy Lin, TJ Maynes
+@subject: calibrating NAO's workspace by moving its arm around by hand.
+"""
+
+import time, threading
+import numpy as np
+
+"""
+
+global variables
+
+"""
+# how often to read the arm's sensors (Hz)
+SAMPLE_RATE = 50
+
+# the arm counts as still while no joint wanders more than this (radians)
+# over a window this long (seconds), so single noisy readings don't break a
+# stop, and a stop has to last this long (seconds) to count
+DWELL_TOLERANCE = 0.02
+DWELL_WINDOW = 0.3
+DWELL_TIME = 1.0
+
+"""
+@class: CalibrationRecorder
+@description: reads the sensed angles of an arm at a fixed rate on a
+background thread while someone moves it around by hand.
+"""
+class CalibrationRecorder(object):
+  def __init__(self, motion, effector="RArm", rate=SAMPLE_RATE):
+    self.motion = motion
+    self.effector = effector
+    self.rate = rate
+    self.times = []
+    self.samples = []
+    self._running = False
+    self._thread = None
+
+  def start(self):
+    self._running = True
+    self._thread = threading.Thread(target=self._sample, name="CalibrationRecorder")
+    self._thread.daemon = True
+    self._thread.start()
+    return self
+
+  """
+  @function: stop
+  @description: stop sampling.
+  @return: the sample times (N) and sensed angles (N x joints)
+  """
+  def stop(self):
+    self._running = False
+    if self._thread is not None:
+      self._thread.join()
+    return np.array(self.times), np.array(self.samples, dtype=np.float64)
+
+  def _sample(self):
+    period = 1.0 / self.rate
+    next_sample = time.time()
+    while self._running:
+      angles = self.motion.getAngles(self.effector, True)
+      self.times.append(time.time())
+      self.samples.append(angles)
+      next_sample += period
+      delay = next_sample - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      else:
+        next_sample = time.time()
+
+"""
+@function: dwells
+@description: find where the arm was held still and average each stop into
+one calibration point.
+@return: the averaged angles of each stop (M x joints) and when each one
+started and ended (M x 2)
+"""
+def dwells(times, samples, tolerance=DWELL_TOLERANCE, window=DWELL_WINDOW, duration=DWELL_TIME):
+  times = np.asarray(times, dtype=np.float64)
+  samples = np.asarray(samples, dtype=np.float64)
+  if len(times) < 2:
+    return np.zeros((0, samples.shape[-1] if samples.ndim == 2 else 0)), np.zeros((0, 2))
+
+  # the window starting at each sample is still when no joint's readings in
+  # it span more than tolerance (windows cut short by the end don't count)
+  last = np.searchsorted(times, times + window, side='right')
+  full = times + window <= times[-1]
+  spread = np.array([np.ptp(samples[a:b], axis=0).max() for a, b in zip(range(len(times)), last)])
+  still_windows = np.flatnonzero(full & (spread <= tolerance))
+
+  # every sample inside a still window is still
+  cover = np.zeros(len(times) + 1, dtype=np.int64)
+  np.add.at(cover, still_windows, 1)
+  np.add.at(cover, last[still_windows], -1)
+  still = np.concatenate([[False], np.cumsum(cover[:-1]) > 0, [False]])
+
+  # runs of still samples, as [start, end)
+  edges = np.diff(still.astype(np.int8))
+  starts = np.flatnonzero(edges == 1)
+  ends = np.flatnonzero(edges == -1)
+  long_enough = times[ends - 1] - times[starts] >= duration
+  starts = starts[long_enough]
+  ends = ends[long_enough]
+
+  points = np.array([samples[a:b].mean(axis=0) for a, b in zip(starts, ends)]).reshape(len(starts), samples.shape[1])
+  spans = np.column_stack([times[starts], times[ends - 1]])
+  return points, spans
+
+"""
+@function: save_samples
+@description: save everything a CalibrationRecorder read, so a recording
+can be looked at again (or its stops found again) if it doesn't make a grid.
+"""
+def save_samples(path, times, samples):
+  np.savez(path, times=np.asarray(times, dtype=np.float64), samples=np.asarray(samples, dtype=np.float64))
+
+"""
+@function: load_samples
+@description: read samples saved by save_samples.
+@return: the sample times (N) and sensed angles (N x joints)
+"""
+def load_samples(path):
+  data = np.load(path)
+  return data["times"], data["samples"]
+
+"""
+@function: save_grid
+@description: save calibration points collected in row by row order
+(every x for the first y, then every x for the next y...) as a compact
+.npz that interpolation.load_grid reads.
+"""
+def save_grid(path, xs, ys, points):
+  points = np.asarray(points, dtype=np.float64)
+  if len(points) != len(xs) * len(ys):
+    raise ValueError('expected %d calibration points, found %d' % (len(xs) * len(ys), len(points)))
+  np.savez(path, xs=np.asarray(xs), ys=np.asarray(ys), joints=points.reshape(len(ys), len(xs), -1))
@@ -0,0 +1,276 @@
+"""
+@file: camera.py
+@authors: Tommy Lin, TJ Maynes
+@subject: getting frames from NAO's camera into OpenCV without going through disk.
+"""
+
+import time, threading, Queue
+from collections import deque
+import numpy as np
+import cv2
+
+"""
+
+global variables
+
+"""
+# rows of pink garbage at the top and bottom of every NAO frame
+CROP_ROWS = 10
+
+# how many debug images can wait to be written before we start dropping them
+DEBUG_QUEUE_SIZE = 8
+
+# how many camera frames to hold before the oldest one gets dropped
+RING_BUFFER_SIZE = 4
+
+# failed grabs in a row before the camera session gives up, and how long
+# to wait after the first one (doubling each time, up to the maximum)
+GRAB_RETRIES = 5
+GRAB_BACKOFF = 0.1
+GRAB_BACKOFF_MAX = 1.0
+
+# seconds to wait for a frame before deciding the camera is not sending any
+FRAME_TIMEOUT = 5.0
+
+# smallest image (pixels either way) fit_frame will blow up to fill the workspace
+MIN_FIT_SIZE = 64
+
+"""
+@function: frame_view
+@description: wrap the pixel buffer of an ALVideoDevice image as a numpy
+array without copying it. naoImage[0] is the width, naoImage[1] the height,
+naoImage[2] the number of layers and naoImage[6] the pixel data.
+@return: a read-only height x width x layers uint8 array
+"""
+def frame_view(naoImage):
+  imageWidth = naoImage[0]
+  imageHeight = naoImage[1]
+  layers = naoImage[2]
+  return np.frombuffer(naoImage[6], dtype=np.uint8).reshape(imageHeight, imageWidth, layers)
+
+"""
+@function: crop_frame
+@description: get rid of the pink garbage at the top and bottom of a frame.
+Slicing whole rows keeps the result a view of the original buffer.
+@return: the cropped frame
+"""
+def crop_frame(frame, rows=CROP_ROWS):
+  return frame[rows:frame.shape[0]-rows]
+
+"""
+@function: fit_frame
+@description: make an image the size of the workspace: a full NAO frame
+loses its pink rows, and anything else is scaled to fit inside and the
+rest filled in with the colour around its edge.
+@return: a height x width image
+"""
+def fit_frame(image, width, height, rows=CROP_ROWS):
+  h, w = image.shape[:2]
+  if (h, w) == (height, width):
+    return image
+  if (h - 2 * rows, w) == (height, width):
+    return crop_frame(image, rows)
+  if min(h, w) < MIN_FIT_SIZE:
+    raise ValueError("a %d x %d image is too small to fit the %d x %d workspace" % (w, h, width, height))
+
+  scale = min(width / float(w), height / float(h))
+  size = (min(width, int(round(w * scale))), min(height, int(round(h * scale))))
+  resized = cv2.resize(image, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+  edge = np.concatenate([image[0], image[-1], image[:, 0], image[:, -1]])
+  left = (width - size[0]) // 2
+  top = (height - size[1]) // 2
+  return cv2.copyMakeBorder(resized, top, height - size[1] - top, left, width - size[0] - left,
+                            cv2.BORDER_CONSTANT, value=np.median(edge, axis=0).tolist())
+
+"""
+@function: grey_frame
+@description: turn an ALVideoDevice RGB image into the cropped greyscale
+frame that Canny works on, all in memory.
+@return: a height-2*CROP_ROWS x width uint8 array
+"""
+def grey_frame(naoImage):
+  return cv2.cvtColor(crop_frame(frame_view(naoImage)), cv2.COLOR_RGB2GRAY)
+
+"""
+@class: DebugWriter
+@description: writes debug images on a background thread so the vision
+loop never waits on a PNG encode. Nothing is written unless enabled, and
+images are dropped rather than queued up when the disk can't keep up.
+"""
+class DebugWriter(object):
+  def __init__(self, enabled=False, maxsize=DEBUG_QUEUE_SIZE):
+    self.enabled = enabled
+    self.dropped = 0
+    self._queue = Queue.Queue(maxsize)
+    self._thread = None
+    self._lock = threading.Lock()
+
+  def write(self, path, image):
+    if not self.enabled:
+      return
+    self._start()
+    try:
+      self._queue.put_nowait((path, image))
+    except Queue.Full:
+      self.dropped += 1
+
+  def flush(self):
+    if self._thread is not None:
+      self._queue.join()
+
+  def _start(self):
+    with self._lock:
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name="DebugWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+  def _run(self):
+    while True:
+      path, image = self._queue.get()
+      try:
+        cv2.imwrite(path, image)
+      except Exception, e:
+        print "Could not write debug image " + path
+        print "Error was: ", e
+      finally:
+        self._queue.task_done()
+
+"""
+@class: CameraSession
+@description: a long-lived subscription to ALVideoDevice. Subscribes once,
+grabs frames on a background thread at the camera's frame rate and keeps
+the newest few in a ring buffer. When the consumer falls behind, the
+oldest frame is dropped. A failed grab is retried with backoff; once
+GRAB_RETRIES of them fail in a row the session gives up, keeps the error
+and every waiting consumer gets an IOError.
+"""
+class CameraSession(object):
+  def __init__(self, video_proxy, resolution, color_space, fps, buffer_size=RING_BUFFER_SIZE, name="NAO_CAM"):
+    self.video_proxy = video_proxy
+    self.video_client = None
+    self.resolution = resolution
+    self.color_space = color_space
+    self.fps = fps
+    self.name = name
+    self.dropped = 0
+    self.grabbed = 0
+    self.error = None
+    self._frames = deque(maxlen=buffer_size)
+    self._ready = threading.Condition()
+    self._running = False
+    self._thread = None
+
+  def start(self):
+    if self._running:
+      return self
+    self.error = None
+    self.video_client = self.video_proxy.subscribe(self.name, self.resolution, self.color_space, self.fps)
+    self._running = True
+    self._thread = threading.Thread(target=self._grab, name=self.name)
+    self._thread.daemon = True
+    self._thread.start()
+    return self
+
+  def stop(self):
+    if not self._running:
+      return
+    self._running = False
+    with self._ready:
+      self._ready.notify_all()
+    self._thread.join()
+    try:
+      self.video_proxy.unsubscribe(self.video_client)
+    except Exception, e:
+      # a camera that gave up may not be there to unsubscribe from
+      print "Could not unsubscribe " + self.name
+      print "Error was: ", e
+    self.video_client = None
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *exc):
+    self.stop()
+
+  def next_frame(self, timeout=None):
+    """oldest buffered frame, or None if nothing arrives within timeout
+    (IOError if the camera has given up)"""
+    with self._ready:
+      if not self._wait(timeout):
+        return None
+      return self._frames.popleft()
+
+  def latest(self, timeout=None):
+    """newest buffered frame (older ones are thrown away), or None
+    (IOError if the camera has given up)"""
+    with self._ready:
+      if not self._wait(timeout):
+        return None
+      naoImage = self._frames.pop()
+      self.dropped += len(self._frames)
+      self._frames.clear()
+      return naoImage
+
+  def frames(self, timeout=None):
+    """yield frames in order for as long as the session is running"""
+    while True:
+      naoImage = self.next_frame(timeout)
+      if naoImage is None:
+        return
+      yield naoImage
+
+  __iter__ = frames
+
+  # caller holds self._ready
+  def _wait(self, timeout):
+    deadline = None if timeout is None else time.time() + timeout
+    while not self._frames:
+      if self.error is not None:
+        raise IOError("%s stopped sending frames: %s" % (self.name, self.error))
+      if not self._running:
+        return False
+      if deadline is None:
+        self._ready.wait()
+      else:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          return False
+        self._ready.wait(remaining)
+    return True
+
+  def _grab(self):
+    period = 1.0 / self.fps
+    last_stamp = None
+    failures = 0
+    while self._running:
+      started = time.time()
+      try:
+        naoImage = self.video_proxy.getImageRemote(self.video_client)
+        if naoImage is None:
+          raise IOError("no image from ALVideoDevice")
+      except Exception, e:
+        failures += 1
+        print "Could not grab a frame from %s (%d of %d)" % (self.name, failures, GRAB_RETRIES)
+        print "Error was: ", e
+        if failures >= GRAB_RETRIES:
+          # wake everyone waiting on a frame so they hear about it
+          with self._ready:
+            self.error = e
+            self._ready.notify_all()
+          return
+        time.sleep(min(GRAB_BACKOFF * 2 ** (failures - 1), GRAB_BACKOFF_MAX))
+        continue
+      failures = 0
+      # naoImage[4] and naoImage[5] are the capture time (seconds, microseconds)
+      if (naoImage[4], naoImage[5]) != last_stamp:
+        last_stamp = (naoImage[4], naoImage[5])
+        with self._ready:
+          if len(self._frames) == self._frames.maxlen:
+            self.dropped += 1
+          self._frames.append(naoImage)
+          self.grabbed += 1
+          self._ready.notify()
+      elapsed = time.time() - started
+      if elapsed < period:
+        time.sleep(period - elapsed)
@@ -0,0 +1,236 @@
+"""
+@file: fakenao.py
+@authors: Tommy Lin, TJ Maynes
+@subject: an in-process stand-in for NAOqi so CannyBot can run without a robot.
+"""
+
+import os, glob, time, threading
+import cv2
+import camera, trajectory
+
+"""
+
+global variables
+
+"""
+# seconds a real NAO takes to go to a new posture, before time_scale
+POSTURE_TIME = 2.0
+
+"""
+@class: FakeModule
+@description: what every NAOqi stand-in has in common. Records every call
+with a time stamp in self.calls, and runs post calls on a background
+thread, with isRunning, wait and stop to follow them like NAOqi's.
+"""
+class FakeModule(object):
+  def __init__(self):
+    self.calls = []
+    self.post = _FakePost(self)
+    self._tasks = {}
+    self._next_id = 1
+    self._lock = threading.Lock()
+
+  def _record(self, method, *args):
+    with self._lock:
+      self.calls.append((time.time(), method, args))
+
+  def _post(self, target, args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    with self._lock:
+      task_id = self._next_id
+      self._next_id += 1
+      self._tasks[task_id] = thread
+    thread.start()
+    return task_id
+
+  def isRunning(self, task_id):
+    thread = self._tasks.get(task_id)
+    return thread is not None and thread.is_alive()
+
+  def wait(self, task_id, timeoutPeriod):
+    thread = self._tasks.get(task_id)
+    if thread is not None:
+      thread.join(timeoutPeriod / 1000.0 if timeoutPeriod else None)
+    return not self.isRunning(task_id)
+
+  def stop(self, task_id):
+    self._record("stop", task_id)
+
+# module.post.method(...) runs module.method(...) on a thread of its own
+class _FakePost(object):
+  def __init__(self, module):
+    self.module = module
+
+  def angleInterpolation(self, names, angleLists, timeLists, isAbsolute):
+    motion = self.module
+    motion._record("post.angleInterpolation", names, angleLists, timeLists, isAbsolute)
+    return motion._post(motion._play, (names, angleLists, timeLists))
+
+  def __getattr__(self, method):
+    if method.startswith("_"):
+      raise AttributeError(method)
+    target = getattr(self.module, method)
+    module = self.module
+    def post(*args):
+      return module._post(target, args)
+    return post
+
+"""
+@class: FakeMotion
+@description: stands in for ALMotion when there is no robot. Plays posted
+trajectories back in real time (scaled by time_scale).
+"""
+class FakeMotion(FakeModule):
+  def __init__(self, time_scale=1.0):
+    FakeModule.__init__(self)
+    self.time_scale = time_scale
+    self.joint_angles = dict((joint, 0.0) for joints in trajectory.ARM_JOINTS.values() for joint in joints)
+
+  # a chain name, a joint name or a list of joint names
+  def _joints(self, names):
+    if isinstance(names, list):
+      return names
+    return trajectory.ARM_JOINTS.get(names, [names])
+
+  def _set_angles(self, names, angles):
+    if not isinstance(angles, list):
+      angles = [angles]
+    for joint, angle in zip(self._joints(names), angles):
+      self.joint_angles[joint] = angle
+
+  def setAngles(self, names, angles, fractionMaxSpeed):
+    self._record("setAngles", names, angles, fractionMaxSpeed)
+    self._set_angles(names, angles)
+
+  def getAngles(self, names, useSensors):
+    self._record("getAngles", names, useSensors)
+    return [self.joint_angles[joint] for joint in self._joints(names)]
+
+  def setStiffnesses(self, names, stiffnesses):
+    self._record("setStiffnesses", names, stiffnesses)
+
+  def stiffnessInterpolation(self, names, stiffnessLists, timeLists):
+    self._record("stiffnessInterpolation", names, stiffnessLists, timeLists)
+
+  def angleInterpolation(self, names, angleLists, timeLists, isAbsolute):
+    self._record("angleInterpolation", names, angleLists, timeLists, isAbsolute)
+    self._play(names, angleLists, timeLists)
+
+  def _play(self, names, angleLists, timeLists):
+    last = max(times[-1] for times in timeLists)
+    time.sleep(last * self.time_scale)
+    self._set_angles(names, [angles[-1] for angles in angleLists])
+
+"""
+@class: FakeTextToSpeech
+@description: stands in for ALTextToSpeech. Records what NAO would have
+said, and takes speaking_time seconds per word to say it.
+"""
+class FakeTextToSpeech(FakeModule):
+  def __init__(self, speaking_time=0.0):
+    FakeModule.__init__(self)
+    self.speaking_time = speaking_time
+
+  def say(self, text):
+    self._record("say", text)
+    time.sleep(self.speaking_time * len(text.split()))
+
+"""
+@class: FakeRobotPosture
+@description: stands in for ALRobotPosture and records every posture asked
+for, taking POSTURE_TIME (scaled by time_scale) to get to a new one.
+"""
+class FakeRobotPosture(FakeModule):
+  def __init__(self, time_scale=0.0):
+    FakeModule.__init__(self)
+    self.time_scale = time_scale
+    self.posture = "Crouch"
+
+  def goToPosture(self, postureName, speed):
+    self._record("goToPosture", postureName, speed)
+    if postureName != self.posture:
+      time.sleep(POSTURE_TIME * self.time_scale)
+    self.posture = postureName
+    return True
+
+  def getPosture(self):
+    return self.posture
+
+"""
+@class: FakeVideoDevice
+@description: stands in for ALVideoDevice when there is no robot. Replays
+the RGB PNGs in debug/ (or any list of files) over and over, padded back
+to the height NAO's camera would give so the usual crop still applies.
+"""
+class FakeVideoDevice(object):
+  def __init__(self, paths=None, pad_rows=camera.CROP_ROWS):
+    if paths is None:
+      paths = [p for p in sorted(glob.glob(os.path.join("debug", "*.png")))
+               if os.path.basename(p).startswith("noognagnook")]
+    self.images = []
+    for path in paths:
+      image = cv2.imread(path)
+      if image is None:
+        raise IOError("could not read " + path)
+      image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+      image = cv2.copyMakeBorder(image, pad_rows, pad_rows, 0, 0, cv2.BORDER_REPLICATE)
+      self.images.append((image.shape, image.tostring()))
+    if not self.images:
+      raise IOError("no images to replay")
+    self.subscribers = {}
+    self._count = 0
+    self._lock = threading.Lock()
+
+  def subscribe(self, name, resolution, color_space, fps):
+    with self._lock:
+      self.subscribers[name] = (resolution, color_space, fps)
+    return name
+
+  def unsubscribe(self, name):
+    with self._lock:
+      self.subscribers.pop(name, None)
+    return True
+
+  def getImageRemote(self, name):
+    with self._lock:
+      if name not in self.subscribers:
+        return None
+      index = self._count % len(self.images)
+      self._count += 1
+    now = time.time()
+    (height, width, layers), pixels = self.images[index]
+    return [width, height, layers, self.subscribers[name][1],
+            int(now), int((now % 1) * 1000000), pixels]
+
+"""
+@class: FakeNAO
+@description: one pretend robot. proxy() has the same arguments as ALProxy
+and hands back the same stand-in every time a module is asked for, so it
+can be dropped in wherever ALProxy is used.
+"""
+class FakeNAO(object):
+  def __init__(self, images=None, time_scale=0.0, speaking_time=0.0):
+    self.modules = {
+      "ALMotion": FakeMotion(time_scale),
+      "ALRobotPosture": FakeRobotPosture(time_scale),
+      "ALTextToSpeech": FakeTextToSpeech(speaking_time),
+      "ALVideoDevice": FakeVideoDevice(images),
+    }
+
+  def proxy(self, name, ip=None, port=None):
+    if name not in self.modules:
+      raise RuntimeError("FakeNAO has no module " + name)
+    return self.modules[name]
+
+  """
+  @function: calls
+  @description: everything every module was asked to do, in time order.
+  @return: a list of (time stamp, module, method, arguments)
+  """
+  def calls(self):
+    calls = []
+    for name, module in self.modules.items():
+      for stamp, method, args in getattr(module, "calls", []):
+        calls.append((stamp, name, method, args))
+    return sorted(calls)
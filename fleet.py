@@ -0,0 +1,188 @@
+"""
+@file: fleet.py
+@authors: Tommy Lin, TJ Maynes
+@subject: driving several NAOs from one laptop, one worker process per robot.
+"""
+
+import os, sys, time, multiprocessing
+import numpy as np
+
+"""
+
+global variables
+
+"""
+# calibration grids for a robot called name, if they have been recorded
+CALIBRATION_PATH = "debug/calibration_%s.npz"
+LEFT_CALIBRATION_PATH = "debug/calibration_%s_left.npz"
+
+PORT = 9559
+
+"""
+@class: RobotSession
+@description: one NAO in the fleet: where to reach it (or a stand-in for
+it), its calibration, and how many cards to draw. run() happens in a worker
+process of its own, so the robot gets its own copy of CannyBot: its own
+proxies, camera session and workspace, and its own GIL.
+"""
+class RobotSession(object):
+  def __init__(self, name, ip=None, port=PORT, calibration=None, left_calibration=None,
+               fake=False, images=None, time_scale=0.0):
+    self.name = name
+    self.ip = ip
+    self.port = port
+    self.calibration = calibration
+    self.left_calibration = left_calibration
+    self.fake = fake
+    self.images = images
+    self.time_scale = time_scale
+
+  """
+  @function: run
+  @description: capture, see and draw cycles times on this robot. A robot
+  that can't be set up comes back with its error instead of stopping the
+  rest of the fleet.
+  @return: a dict of "name", "cycles", "shapes", "errors", "seconds",
+  "capture", "see" and "draw" (mean milliseconds per cycle) and "failure"
+  (None unless the robot could not be set up)
+  """
+  def run(self, cycles):
+    # the worker's own CannyBot connects to this robot below
+    import CannyBot, fakenao, interpolation
+
+    timings = {"capture": [], "see": [], "draw": []}
+    shapes = 0
+    errors = 0
+    failure = None
+    started = time.time()
+    try:
+      # each robot draws in its own workspace, from its own calibration
+      # (or the host's, which is only right for a robot set up the same)
+      CannyBot.ip = self.ip
+      CannyBot.port = self.port
+      if self.calibration is not None:
+        CannyBot.set_workspace(interpolation.load_grid(self.calibration))
+      if self.left_calibration is not None:
+        CannyBot.set_workspace(interpolation.load_grid(self.left_calibration), "LArm")
+      CannyBot.tracer.path = "debug/trace_%s.jsonl" % self.name
+      if self.fake:
+        CannyBot.connect(fakenao.FakeNAO(self.images, self.time_scale).proxy)
+      else:
+        CannyBot.connect(CannyBot.ALProxy)
+      CannyBot.motionProxy.setStiffnesses("LArm", 1.0)
+      CannyBot.motionProxy.setStiffnesses("RArm", 1.0)
+    except Exception, e:
+      failure = str(e)
+      print "Robot " + self.name + " could not be set up"
+      print "Error was: ", e
+
+    try:
+      for cycle in range(cycles if failure is None else 0):
+        try:
+          began = time.time()
+          gray = CannyBot.capture()
+          captured = time.time()
+          polygons, labels, paths = CannyBot.see_shapes(gray)
+          seen = time.time()
+          CannyBot.draw_shapes(polygons, paths)
+          drawn = time.time()
+        except Exception, e:
+          errors += 1
+          print "Robot " + self.name + " failed a cycle"
+          print "Error was: ", e
+          continue
+        timings["capture"].append(captured - began)
+        timings["see"].append(seen - captured)
+        timings["draw"].append(drawn - seen)
+        shapes += len(paths)
+    finally:
+      CannyBot.close_eyes()
+      CannyBot.tracer.flush()
+
+    stats = {"name": self.name, "cycles": len(timings["draw"]), "shapes": shapes, "errors": errors,
+             "seconds": time.time() - started, "failure": failure}
+    for stage, seconds in timings.items():
+      stats[stage] = np.mean(seconds) * 1000.0 if seconds else 0.0
+    return stats
+
+def _run(job):
+  number, session, cycles = job
+  return number, session.run(cycles)
+
+"""
+@function: session
+@description: a RobotSession for a robot given as name=ip[:port] (or just
+ip[:port], which is also its name), using its calibration grids in
+debug/ if they have been recorded.
+@return: the RobotSession
+"""
+def session(spec):
+  name, _, address = spec.rpartition("=")
+  ip, _, port = address.partition(":")
+  name = name or ip
+  calibration = CALIBRATION_PATH % name
+  left_calibration = LEFT_CALIBRATION_PATH % name
+  return RobotSession(name, ip, int(port or PORT),
+                      calibration if os.path.exists(calibration) else None,
+                      left_calibration if os.path.exists(left_calibration) else None)
+
+"""
+@function: stand_ins
+@description: count pretend robots, for trying the fleet out without any.
+@return: a list of RobotSessions
+"""
+def stand_ins(count, images=None, time_scale=0.1):
+  return [RobotSession("fake%d" % n, fake=True, images=images, time_scale=time_scale) for n in range(count)]
+
+"""
+@function: run
+@description: run every robot's cycles at the same time, one process each,
+collecting each robot's stats as soon as it is done.
+@return: each robot's stats, in the order the sessions were given
+"""
+def run(sessions, cycles=10):
+  workers = multiprocessing.Pool(len(sessions), maxtasksperchild=1)
+  stats = [None] * len(sessions)
+  try:
+    for number, robot in workers.imap_unordered(_run, [(n, s, cycles) for n, s in enumerate(sessions)]):
+      stats[number] = robot
+  finally:
+    workers.close()
+    workers.join()
+  return stats
+
+"""
+@function: report
+@description: print how each robot did and the fleet's total throughput.
+"""
+def report(stats, seconds):
+  print "%-12s %7s %7s %7s %12s %12s %10s %10s %10s" % ("robot", "cycles", "shapes", "errors", "cycles/s",
+                                                         "shapes/s", "capture", "see", "draw (ms)")
+  for s in stats:
+    if s["failure"] is not None:
+      print "%-12s failed: %s" % (s["name"], s["failure"])
+      continue
+    print "%-12s %7d %7d %7d %12.2f %12.2f %10.2f %10.2f %10.2f" % (s["name"], s["cycles"], s["shapes"], s["errors"],
+                                                                  s["cycles"] / s["seconds"], s["shapes"] / s["seconds"],
+                                                                  s["capture"], s["see"], s["draw"])
+  cycles = sum(s["cycles"] for s in stats)
+  print "fleet: %d cycles in %.2f s (%.2f per second)" % (cycles, seconds, cycles / seconds)
+
+if __name__ == '__main__':
+  # python fleet.py [--cycles N] name=ip[:port] ...
+  # python fleet.py [--cycles N] --fake N
+  args = sys.argv[1:]
+  cycles = 10
+  if "--cycles" in args:
+    at = args.index("--cycles")
+    cycles = int(args[at + 1])
+    del args[at:at + 2]
+  if "--fake" in args:
+    at = args.index("--fake")
+    sessions = stand_ins(int(args[at + 1]))
+  else:
+    sessions = [session(spec) for spec in args]
+
+  started = time.time()
+  stats = run(sessions, cycles)
+  report(stats, time.time() - started)
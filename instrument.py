@@ -0,0 +1,309 @@
+"""
+@file: instrument.py
+@authors: Tommy Lin, TJ Maynes
+@subject: timing where the seconds go in a drawing cycle, for next to nothing when switched off.
+"""
+
+import time, math, json, atexit, threading
+
+"""
+
+global variables
+
+"""
+# histogram buckets: BUCKETS_PER_DOUBLING per doubling of time, from
+# SMALLEST_TIME seconds up to about 2^(BUCKETS / BUCKETS_PER_DOUBLING) times that
+SMALLEST_TIME = 1e-6
+BUCKETS_PER_DOUBLING = 4
+BUCKETS = 108
+
+PERCENTILES = [50, 90, 99]
+
+"""
+@class: Histogram
+@description: counts of times in log spaced buckets, plus their count,
+total, minimum and maximum. Percentiles come out at the top of the
+bucket they fall in, so within about 19% with four buckets a doubling.
+"""
+class Histogram(object):
+  def __init__(self):
+    self.buckets = [0] * BUCKETS
+    self.count = 0
+    self.total = 0.0
+    self.min = float('inf')
+    self.max = 0.0
+
+  def add(self, seconds):
+    if seconds > SMALLEST_TIME:
+      bucket = min(BUCKETS - 1, int(math.log(seconds / SMALLEST_TIME, 2) * BUCKETS_PER_DOUBLING))
+    else:
+      bucket = 0
+    self.buckets[bucket] += 1
+    self.count += 1
+    self.total += seconds
+    if seconds < self.min:
+      self.min = seconds
+    if seconds > self.max:
+      self.max = seconds
+
+  def percentile(self, p):
+    wanted = self.count * p / 100.0
+    seen = 0
+    for bucket, n in enumerate(self.buckets):
+      seen += n
+      if n and seen >= wanted:
+        return min(self.max, SMALLEST_TIME * 2 ** ((bucket + 1.0) / BUCKETS_PER_DOUBLING))
+    return self.max
+
+  def as_dict(self):
+    return {"count": self.count, "total": self.total, "min": self.min if self.count else 0.0,
+            "max": self.max, "buckets": self.buckets}
+
+"""
+@class: NullSpan
+@description: what span() hands out while instruments are switched off.
+"""
+class NullSpan(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+NULL_SPAN = NullSpan()
+
+"""
+@class: Span
+@description: times the code inside a with block into a named histogram
+(and onto the timeline, if it is one of the spans that goes there).
+"""
+class Span(object):
+  def __init__(self, instruments, name, timeline=False):
+    self.instruments = instruments
+    self.name = name
+    self.timeline = timeline
+
+  def __enter__(self):
+    self.started = time.time()
+    return self
+
+  def __exit__(self, *exc):
+    if self.timeline:
+      self.instruments.event(self.name, self.started, time.time())
+    else:
+      self.instruments.record(self.name, time.time() - self.started)
+    return False
+
+"""
+@class: Instruments
+@description: named time histograms and counters, kept in memory, and
+optionally a timeline of when each event (like a command NAO was given)
+started and finished. While switched off, span(), event() and count()
+return straight away without touching a clock or a lock.
+"""
+class Instruments(object):
+  def __init__(self, enabled=False, path=None):
+    self.enabled = enabled
+    self.path = path
+    self.histograms = {}
+    self.counters = {}
+    self.timeline = None
+    self.timeline_path = None
+    self._lock = threading.Lock()
+    self._registered = False
+
+  """
+  @function: enable
+  @description: start recording. With a path, everything recorded is
+  written there (and printed) when the program exits.
+  """
+  def enable(self, path=None):
+    self.enabled = True
+    if path is not None:
+      self.path = path
+    if not self._registered:
+      self._registered = True
+      atexit.register(self._at_exit)
+    return self
+
+  """
+  @function: enable_timeline
+  @description: start recording, keeping every event on the timeline as
+  well. With a path, the timeline is written there (and printed) when the
+  program exits.
+  """
+  def enable_timeline(self, path=None):
+    with self._lock:
+      if self.timeline is None:
+        self.timeline = []
+    if path is not None:
+      self.timeline_path = path
+    return self.enable()
+
+  def disable(self):
+    self.enabled = False
+
+  def reset(self):
+    with self._lock:
+      self.histograms = {}
+      self.counters = {}
+    self.clear_timeline()
+
+  def clear_timeline(self):
+    with self._lock:
+      if self.timeline is not None:
+        self.timeline = []
+
+  """
+  @function: span
+  @description: time a with block under name, on the timeline too if
+  timeline is set.
+  @return: a context manager
+  """
+  def span(self, name, timeline=False):
+    if not self.enabled:
+      return NULL_SPAN
+    return Span(self, name, timeline)
+
+  """
+  @function: timed
+  @description: a decorator that times every call to a function under name.
+  """
+  def timed(self, name):
+    def decorate(function):
+      def wrapper(*args, **kwargs):
+        if not self.enabled:
+          return function(*args, **kwargs)
+        with Span(self, name):
+          return function(*args, **kwargs)
+      wrapper.__name__ = function.__name__
+      wrapper.__doc__ = function.__doc__
+      return wrapper
+    return decorate
+
+  def record(self, name, seconds):
+    with self._lock:
+      histogram = self.histograms.get(name)
+      if histogram is None:
+        histogram = self.histograms[name] = Histogram()
+      histogram.add(seconds)
+
+  """
+  @function: event
+  @description: record something that ran from started to finished (times
+  from time.time()), on the timeline if one is being kept.
+  """
+  def event(self, name, started, finished):
+    if not self.enabled:
+      return
+    self.record(name, finished - started)
+    with self._lock:
+      if self.timeline is not None:
+        self.timeline.append((started, finished, name))
+
+  """
+  @function: overlap
+  @description: how long everything on the timeline would take one after
+  the other, and how long it actually took from the first start to the
+  last finish.
+  @return: (seconds one after the other, seconds of wall clock)
+  """
+  def overlap(self):
+    with self._lock:
+      events = sorted(self.timeline or [])
+    if not events:
+      return 0.0, 0.0
+    serial = sum(finished - started for started, finished, name in events)
+    wall = max(finished for started, finished, name in events) - events[0][0]
+    return serial, wall
+
+  def count(self, name, n=1):
+    if not self.enabled:
+      return
+    with self._lock:
+      self.counters[name] = self.counters.get(name, 0) + n
+
+  """
+  @function: report
+  @description: print every histogram (in milliseconds) and counter.
+  """
+  def report(self):
+    with self._lock:
+      histograms = sorted(self.histograms.items())
+      counters = sorted(self.counters.items())
+    print "%-30s %8s %10s" % ("span", "count", "total (s)") + "".join("%9s" % ("p%d" % p) for p in PERCENTILES) + "%9s" % "max"
+    for name, h in histograms:
+      print "%-30s %8d %10.3f" % (name, h.count, h.total) + "".join("%9.2f" % (h.percentile(p) * 1000.0) for p in PERCENTILES) + "%9.2f" % (h.max * 1000.0)
+    for name, n in counters:
+      print "%-30s %8d" % (name, n)
+
+  """
+  @function: report_timeline
+  @description: print every event on the timeline, from when it began, and
+  what overlapping them saved.
+  """
+  def report_timeline(self):
+    with self._lock:
+      events = sorted(self.timeline or [])
+    if not events:
+      return
+    began = events[0][0]
+    print "%-40s %10s %10s" % ("timeline", "start (s)", "took (s)")
+    for started, finished, name in events:
+      print "%-40s %10.3f %10.3f" % (name, started - began, finished - started)
+    serial, wall = self.overlap()
+    print "%.2f s in %.2f s, %.2f s saved by overlapping" % (serial, wall, serial - wall)
+
+  """
+  @function: dump
+  @description: write every histogram and counter to a JSON file.
+  """
+  def dump(self, path=None):
+    with self._lock:
+      data = {
+        "bucket_edges": [SMALLEST_TIME * 2 ** (float(b) / BUCKETS_PER_DOUBLING) for b in range(BUCKETS + 1)],
+        "spans": dict((name, h.as_dict()) for name, h in self.histograms.items()),
+        "counters": dict(self.counters),
+      }
+    f = open(path or self.path, 'w')
+    json.dump(data, f, indent=1)
+    f.close()
+
+  """
+  @function: dump_timeline
+  @description: write the timeline to a JSON file, one {"name", "start",
+  "end"} per event.
+  """
+  def dump_timeline(self, path=None):
+    with self._lock:
+      events = sorted(self.timeline or [])
+    f = open(path or self.timeline_path, 'w')
+    json.dump([{"name": name, "start": started, "end": finished} for started, finished, name in events], f, indent=1)
+    f.close()
+
+  def _at_exit(self):
+    if not self.enabled:
+      return
+    if self.histograms or self.counters:
+      self.report()
+      if self.path is not None:
+        try:
+          self.dump()
+        except Exception, e:
+          print "Could not write timings to " + self.path
+          print "Error was: ", e
+    if self.timeline:
+      self.report_timeline()
+      if self.timeline_path is not None:
+        try:
+          self.dump_timeline()
+        except Exception, e:
+          print "Could not write the timeline to " + self.timeline_path
+          print "Error was: ", e
+
+# one set of instruments shared by every module
+instruments = Instruments()
+span = instruments.span
+event = instruments.event
+count = instruments.count
+timed = instruments.timed
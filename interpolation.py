@@ -0,0 +1,213 @@
+"""
+@file: interpolation.py
+@authors: Tommy Lin, TJ Maynes
+@subject: mapping pixels in NAO's camera frame to joint angles in NAO's workspace.
+"""
+
+import re
+import numpy as np
+
+"""
+
+global variables
+
+"""
+# rows of the raster computed at a time when baking
+BAKE_ROWS = 64
+
+"""
+@class: CalibrationGrid
+@description: bilinear interpolation over an M x N grid of recorded joint
+angles. xs and ys are the sorted pixel coordinates of the grid lines and
+joints[j][i] holds the joint angles recorded at (xs[i], ys[j]).
+http://en.wikipedia.org/wiki/Bilinear_interpolation
+"""
+class CalibrationGrid(object):
+  def __init__(self, xs, ys, joints):
+    self.xs = np.asarray(xs)
+    self.ys = np.asarray(ys)
+    self.joints = np.asarray(joints, dtype=np.float64)
+
+    if len(self.xs) < 2 or len(self.ys) < 2:
+      raise ValueError('need at least a 2 x 2 grid')
+    if (np.diff(self.xs) <= 0).any() or (np.diff(self.ys) <= 0).any():
+      raise ValueError('grid lines must be strictly increasing')
+    if self.joints.shape[:2] != (len(self.ys), len(self.xs)):
+      raise ValueError('joints must be len(ys) x len(xs) x joints')
+
+  """
+  @function: cells
+  @description: binary search for the grid cell holding each pixel.
+  @return: column and row index of the top left corner of each cell
+  """
+  def cells(self, x, y):
+    if ((x < self.xs[0]) | (x > self.xs[-1]) | (y < self.ys[0]) | (y > self.ys[-1])).any():
+      raise ValueError('(x, y) not within the rectangle')
+    i = np.clip(np.searchsorted(self.xs, x, 'right') - 1, 0, len(self.xs) - 2)
+    j = np.clip(np.searchsorted(self.ys, y, 'right') - 1, 0, len(self.ys) - 2)
+    return i, j
+
+  """
+  @function: map
+  @description: interpolate joint angles for every pixel in points, which can
+  be an N x 2 array or a contour straight from OpenCV (N x 1 x 2).
+  Operations happen in the same order as bilinear_interpolation, so a 2 x 2
+  grid gives identical results to calling it point by point.
+  @return: an N x joints array of joint angles
+  """
+  def map(self, points):
+    points = np.asarray(points).reshape(-1, 2)
+    x = points[:, 0]
+    y = points[:, 1]
+    i, j = self.cells(x, y)
+
+    x1 = self.xs[i][:, None]
+    x2 = self.xs[i + 1][:, None]
+    y1 = self.ys[j][:, None]
+    y2 = self.ys[j + 1][:, None]
+    x = x[:, None]
+    y = y[:, None]
+
+    q11 = self.joints[j, i]
+    q12 = self.joints[j + 1, i]
+    q21 = self.joints[j, i + 1]
+    q22 = self.joints[j + 1, i + 1]
+
+    temp1 = q11 * (x2 - x) * (y2 - y)
+    temp2 = q21 * (x - x1) * (y2 - y)
+    temp3 = q12 * (x2 - x) * (y - y1)
+    temp4 = q22 * (x - x1) * (y - y1)
+    return ((temp1 + temp2) + (temp3 + temp4)) / ((x2 - x1) * (y2 - y1) + 0.0)
+
+  """
+  @function: corners
+  @description: the joint angles at the four corners of the grid.
+  @return: [[x, y, joint_angles], ...] top left, top right, bottom left,
+  bottom right, like workspace_corners
+  """
+  def corners(self):
+    return [[self.xs[i], self.ys[j], self.joints[j, i]] for j in (0, -1) for i in (0, -1)]
+
+  """
+  @function: bake
+  @description: interpolate every whole pixel in the grid once and save the
+  result as a memory-mapped .npy raster, a few rows at a time. The grid has
+  to start at pixel (0, 0) so raster[y, x] is the joint angles for (x, y).
+  @return: a RasterLookup reading from the new file
+  """
+  def bake(self, path, dtype=np.float64):
+    if self.xs[0] != 0 or self.ys[0] != 0:
+      raise ValueError('grid must start at pixel (0, 0) to bake')
+    width = int(self.xs[-1]) + 1
+    height = int(self.ys[-1]) + 1
+    raster = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                       shape=(height, width, self.joints.shape[2]))
+    x = np.arange(width)
+    for top in range(0, height, BAKE_ROWS):
+      y = np.arange(top, min(top + BAKE_ROWS, height))
+      points = np.dstack(np.meshgrid(x, y)).reshape(-1, 2)
+      raster[top:top + len(y)] = self.map(points).reshape(len(y), width, -1)
+    raster.flush()
+    del raster
+    return RasterLookup(path)
+
+"""
+@class: Interpolator
+@description: the original four corner calibration, as a 2 x 2 grid.
+"""
+class Interpolator(CalibrationGrid):
+  """
+  @function: __init__
+  @description: values is the same list bilinear_interpolation takes,
+  [[x, y, joint_angles], ...] for the four corners of a rectangle.
+  """
+  def __init__(self, values):
+    values = sorted(values)
+
+    # check that the values form a rectangle
+    if values[0][0] != values[1][0] or values[2][0] != values[3][0] or values[0][1] != values[2][1] or values[1][1] != values[3][1]:
+      raise ValueError('points do not form a rectangle')
+
+    xs = [values[0][0], values[2][0]]
+    ys = [values[0][1], values[1][1]]
+    joints = [[values[0][2], values[2][2]],
+              [values[1][2], values[3][2]]]
+    CalibrationGrid.__init__(self, xs, ys, joints)
+
+"""
+@class: RasterLookup
+@description: joint angles for every pixel, read straight out of a baked
+.npy raster. Mapping a pixel is an array read instead of an interpolation.
+"""
+class RasterLookup(object):
+  def __init__(self, path):
+    self.path = path
+    self.raster = np.load(path, mmap_mode='r')
+
+  def map(self, points):
+    points = np.asarray(points).reshape(-1, 2)
+    x = points[:, 0]
+    y = points[:, 1]
+    height, width = self.raster.shape[:2]
+    if ((x < 0) | (x >= width) | (y < 0) | (y >= height)).any():
+      raise ValueError('(x, y) not within the rectangle')
+    return np.asarray(self.raster[y.astype(np.intp), x.astype(np.intp)], dtype=np.float64)
+
+  def corners(self):
+    height, width = self.raster.shape[:2]
+    return [[x, y, np.asarray(self.raster[y, x], dtype=np.float64)] for y in (0, height - 1) for x in (0, width - 1)]
+
+"""
+@function: read_recorded_grid
+@description: build a calibration grid from the samples record_joint_angles
+appends to debug/input.txt. Only blocks whose coordinate reads as "x, y"
+are used, and the sensed RArm angles are taken for each one.
+@return: a CalibrationGrid
+"""
+def read_recorded_grid(path='debug/input.txt'):
+  text = open(path).read()
+  samples = {}
+  for block in text.split("Coordinate:")[1:]:
+    coordinate = re.match(r"\s*(-?\d+)\s*[, ]\s*(-?\d+)", block)
+    rarm = block.split("RArm:")
+    if coordinate is None or len(rarm) < 2:
+      continue
+    sensed = re.search(r"Sensor Angles:\s*\[([^\]]*)\]", rarm[1])
+    if sensed is None:
+      continue
+    key = (int(coordinate.group(1)), int(coordinate.group(2)))
+    samples[key] = [float(v) for v in sensed.group(1).split(",")]
+
+  return grid_from_samples(samples.keys(), samples.values())
+
+"""
+@function: grid_from_samples
+@description: build a calibration grid from pixels (N x 2) and the joint
+angles recorded at each (N x joints), such as the "calibration" records of
+a trace. Samples at the same pixel are averaged, and every combination of
+the x and y values seen has to be there.
+@return: a CalibrationGrid
+"""
+def grid_from_samples(pixels, joints):
+  pixels = np.asarray(pixels).reshape(-1, 2)
+  joints = np.asarray(joints, dtype=np.float64)
+  xs, column = np.unique(pixels[:, 0], return_inverse=True)
+  ys, row = np.unique(pixels[:, 1], return_inverse=True)
+
+  total = np.zeros((len(ys), len(xs), joints.shape[1]))
+  count = np.zeros((len(ys), len(xs)))
+  np.add.at(total, (row, column), joints)
+  np.add.at(count, (row, column), 1)
+  if (count == 0).any():
+    missing = [(xs[i], ys[j]) for j, i in zip(*np.nonzero(count == 0))]
+    raise ValueError('calibration grid is missing ' + str(missing))
+  return CalibrationGrid(xs, ys, total / count[:, :, None])
+
+"""
+@function: load_grid
+@description: load a calibration grid saved by calibration.save_grid.
+@return: a CalibrationGrid
+"""
+def load_grid(path):
+  data = np.load(path)
+  return CalibrationGrid(data['xs'], data['ys'], data['joints'])
@@ -0,0 +1,385 @@
+"""
+@file: kinematics.py
+@authors: Tommy Lin, TJ Maynes
+@subject: forward and inverse kinematics for NAO's arm, for whole paths at once.
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+"""
+
+global variables
+
+"""
+# inverse kinematics settings (distances in mm, angles in radians)
+IK_TOLERANCE = 0.5
+IK_ITERATIONS = 50
+IK_DAMPING = 10.0
+IK_STEP = 1e-6
+
+# solutions are cached by target position rounded to this many mm
+IK_CACHE_RESOLUTION = 0.5
+IK_CACHE_SIZE = 10000
+
+# no joint should move more than this (radians) from one point of a path to
+# the next
+IK_MAX_STEP = 0.05
+
+# (min, max, lower margin, upper margin) in degrees for each arm joint, in
+# getAngles order. Paths are kept the margin inside min and max.
+JOINT_LIMITS = {
+  "RArm": [(-119.5, 119.5, 9.5, 9.5),   # RShoulderPitch
+           (-76.0, 18.0, 6.0, 3.0),     # RShoulderRoll
+           (-119.5, 119.5, 9.5, 9.5),   # RElbowYaw
+           (2.0, 88.5, 3.0, 8.5),       # RElbowRoll
+           (-104.5, 104.5, 4.5, 4.5)],  # RWristYaw
+  "LArm": [(-119.5, 119.5, 9.5, 9.5),   # LShoulderPitch
+           (-18.0, 76.0, 3.0, 6.0),     # LShoulderRoll
+           (-119.5, 119.5, 9.5, 9.5),   # LElbowYaw
+           (-88.5, -2.0, 8.5, 3.0),     # LElbowRoll
+           (-104.5, 104.5, 4.5, 4.5)],  # LWristYaw
+}
+
+# the hand isn't an angle, it goes from 0 (closed) to 1 (open)
+HAND_LIMITS = (0.0, 1.0, 0.0, 0.0)
+
+# NAO is left-right symmetric: a left arm pose is the right arm pose with
+# every roll and yaw negated (pitch and the hand stay the same)
+MIRROR = [1.0, -1.0, -1.0, -1.0, -1.0, 1.0]
+
+"""
+@function: dh_matrices
+@description: Denavit-Hartenberg transformation matrix for one joint at
+every angle in theta (radians), laid out the same way as transformation().
+@return: a K x 4 x 4 array
+"""
+def dh_matrices(a, alpha, distance, theta):
+  theta = np.asarray(theta, dtype=np.float64)
+  ct = np.cos(theta)
+  st = np.sin(theta)
+  ca = np.cos(alpha)
+  sa = np.sin(alpha)
+
+  matrices = np.zeros(theta.shape + (4, 4))
+  matrices[..., 0, 0] = ct
+  matrices[..., 0, 1] = -st * ca
+  matrices[..., 0, 2] = st * sa
+  matrices[..., 0, 3] = a * ct
+  matrices[..., 1, 0] = st
+  matrices[..., 1, 1] = ct * ca
+  matrices[..., 1, 2] = -ct * sa
+  matrices[..., 1, 3] = a * st
+  matrices[..., 2, 1] = sa
+  matrices[..., 2, 2] = ca
+  matrices[..., 2, 3] = distance
+  matrices[..., 3, 3] = 1.0
+  return matrices
+
+"""
+@class: ArmChain
+@description: a serial chain of DH joints hanging off a fixed base offset.
+Every method takes a K x joints array of angles in radians (extra columns,
+like the hand, are ignored) and works on all K poses at once.
+"""
+class ArmChain(object):
+  """
+  @function: __init__
+  @description: names are the joint names, dh is one (a, alpha, distance,
+  theta_offset) per joint and base is the (x, y, z) of the first joint.
+  A mirrored chain is the left-right (y) reflection of the one described,
+  with its angles mirrored to match.
+  """
+  def __init__(self, names, dh, base, mirrored=False):
+    self.names = names
+    self.dh = dh
+    self.base = np.eye(4)
+    self.base[:3, 3] = base
+    self.mirrored = mirrored
+
+  def _thetas(self, thetas):
+    thetas = np.asarray(thetas, dtype=np.float64)
+    if thetas.ndim == 1:
+      thetas = thetas[None, :]
+    thetas = thetas[:, :len(self.dh)]
+    if self.mirrored:
+      thetas = mirror(thetas)
+    return thetas
+
+  """
+  @function: joint_transforms
+  @description: the transformation matrix of every joint for every pose.
+  @return: a K x joints x 4 x 4 array
+  """
+  def joint_transforms(self, thetas):
+    thetas = self._thetas(thetas)
+    return np.array([dh_matrices(a, alpha, distance, thetas[:, i] + offset)
+                     for i, (a, alpha, distance, offset) in enumerate(self.dh)]).swapaxes(0, 1)
+
+  """
+  @function: transforms
+  @description: multiply the joints together to get the end effector.
+  @return: a K x 4 x 4 array of base to end effector transforms
+  """
+  def transforms(self, thetas):
+    joints = self.joint_transforms(thetas)
+    result = np.tile(self.base, (joints.shape[0], 1, 1))
+    for i in range(joints.shape[1]):
+      result = np.einsum('kij,kjl->kil', result, joints[:, i])
+    if self.mirrored:
+      result[:, 1, :] *= -1
+      result[:, :, 1] *= -1
+    return result
+
+  """
+  @function: positions
+  @description: where the end effector is for every pose.
+  @return: a K x 3 array of x, y, z
+  """
+  def positions(self, thetas):
+    return self.transforms(thetas)[:, :3, 3]
+
+  """
+  @function: within
+  @description: check a whole path against a box in the base frame.
+  @return: a boolean array, True where the end effector is inside the box
+  """
+  def within(self, thetas, lower, upper):
+    positions = self.positions(thetas)
+    return ((positions >= lower) & (positions <= upper)).all(axis=1)
+
+"""
+@function: right_arm
+@description: NAO's right arm chain, from the arm dimensions in CannyBot.
+@return: an ArmChain for RShoulderPitch through RWristYaw
+"""
+def right_arm(elbow_offset_y, upper_arm_length, lower_arm_length, shoulder_offset_y, shoulder_offset_z):
+  names = ["RShoulderPitch", "RShoulderRoll", "RElbowYaw", "RElbowRoll", "RWristYaw"]
+  dh = [(0, -np.pi/2.0, 0, 0),
+        (0, np.pi/2.0, 0, np.pi/2.0),
+        (-elbow_offset_y, np.pi/2.0, upper_arm_length, 0),
+        (0, -np.pi/2.0, 0, 0),
+        (lower_arm_length, np.pi/2.0, 0, 0)]
+  return ArmChain(names, dh, (0, -shoulder_offset_y, shoulder_offset_z))
+
+"""
+@function: left_arm
+@description: the mirror image of right_arm, on NAO's other shoulder.
+@return: an ArmChain
+"""
+def left_arm(elbow_offset_y, upper_arm_length, lower_arm_length, shoulder_offset_y, shoulder_offset_z):
+  chain = right_arm(elbow_offset_y, upper_arm_length, lower_arm_length, shoulder_offset_y, shoulder_offset_z)
+  names = ["LShoulderPitch", "LShoulderRoll", "LElbowYaw", "LElbowRoll", "LWristYaw"]
+  return ArmChain(names, chain.dh, chain.base[:3, 3], mirrored=True)
+
+"""
+@function: mirror
+@description: turn right arm joint angles into the left arm's mirror image
+of them, or back again.
+@return: an array of joint angles, the same shape as thetas
+"""
+def mirror(thetas):
+  thetas = np.asarray(thetas, dtype=np.float64)
+  return thetas * np.asarray(MIRROR)[:thetas.shape[-1]]
+
+"""
+@class: InverseKinematics
+@description: damped least squares (Levenberg-Marquardt) inverse kinematics
+on top of an ArmChain. Solves every target of a path in one batch, caches
+solutions by rounded target position, and re-solves any target that didn't
+converge, or that jumps away from the previous target's solution, starting
+from that solution.
+"""
+class InverseKinematics(object):
+  def __init__(self, chain, lower=None, upper=None, tolerance=IK_TOLERANCE, iterations=IK_ITERATIONS,
+               damping=IK_DAMPING, resolution=IK_CACHE_RESOLUTION, cache_size=IK_CACHE_SIZE):
+    self.chain = chain
+    self.lower = lower
+    self.upper = upper
+    self.tolerance = tolerance
+    self.iterations = iterations
+    self.damping = damping
+    self.resolution = resolution
+    self.cache_size = cache_size
+    self.cache = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def _clip(self, thetas):
+    if self.lower is not None or self.upper is not None:
+      thetas = np.clip(thetas, self.lower, self.upper)
+    return thetas
+
+  """
+  @function: jacobian
+  @description: numerical jacobian of the end effector position for every
+  pose, from one batched forward kinematics call.
+  @return: positions (K x 3) and jacobians (K x 3 x joints)
+  """
+  def jacobian(self, thetas):
+    count, joints = thetas.shape
+    nudged = np.repeat(thetas[:, None, :], joints + 1, axis=1)
+    nudged[:, 1:] += np.eye(joints) * IK_STEP
+    positions = self.chain.positions(nudged.reshape(-1, joints)).reshape(count, joints + 1, 3)
+    return positions[:, 0], ((positions[:, 1:] - positions[:, :1]) / IK_STEP).transpose(0, 2, 1)
+
+  """
+  @function: refine
+  @description: run Levenberg-Marquardt on every pose at once until each
+  one is within tolerance of its target or we run out of iterations.
+  @return: the solved angles and which of them converged
+  """
+  def refine(self, targets, thetas):
+    thetas = self._clip(np.array(thetas, dtype=np.float64))
+    damping = np.empty(len(thetas))
+    damping.fill(self.damping)
+    positions, jacobians = self.jacobian(thetas)
+    errors = targets - positions
+    distance = np.sqrt((errors ** 2).sum(axis=1))
+    active = np.flatnonzero(distance > self.tolerance)
+
+    for iteration in range(self.iterations):
+      if not len(active):
+        break
+      J = jacobians[active]
+      e = errors[active]
+      lam = damping[active]
+
+      # dq = J^T (J J^T + lambda^2 I)^-1 e
+      JJt = np.einsum('kij,klj->kil', J, J) + (lam ** 2)[:, None, None] * np.eye(3)
+      step = np.einsum('kji,kj->ki', J, np.linalg.solve(JJt, e[:, :, None])[:, :, 0])
+      candidate = self._clip(thetas[active] + step)
+
+      new_positions, new_jacobians = self.jacobian(candidate)
+      new_errors = targets[active] - new_positions
+      new_distance = np.sqrt((new_errors ** 2).sum(axis=1))
+
+      # keep steps that got closer and trust them more, back off on the rest
+      better = new_distance < distance[active]
+      accepted = active[better]
+      thetas[accepted] = candidate[better]
+      jacobians[accepted] = new_jacobians[better]
+      errors[accepted] = new_errors[better]
+      distance[accepted] = new_distance[better]
+      damping[active] = np.where(better, lam * 0.5, lam * 4.0)
+      active = active[distance[active] > self.tolerance]
+
+    return thetas, distance <= self.tolerance
+
+  def _key(self, target):
+    return tuple(np.round(target / self.resolution).astype(int))
+
+  """
+  @function: solve
+  @description: joint angles for every target position in a path (K x 3).
+  Cached solutions seed a path whose every target is cached, and otherwise
+  everything starts from seed: one pose for every target (like where the
+  arm is now) or, better, one per target (like its interpolated angles).
+  Targets that still don't
+  converge, or jump more than max_step from the previous target, are tried
+  again one by one, warm-started from the previous target.
+  @return: the K x joints angles and which of them converged
+  """
+  def solve(self, targets, seed, max_step=IK_MAX_STEP):
+    targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+    seed = np.asarray(seed, dtype=np.float64)[..., :len(self.chain.dh)]
+    keys = [self._key(target) for target in targets]
+
+    # a solution can put the arm in any of many poses, so cached ones are
+    # only used for a path that is cached all the way along: mixed in with
+    # fresh solutions they make the arm jump from one pose to another
+    guesses = np.array(np.broadcast_to(seed, (len(targets), seed.shape[-1])))
+    cached = [self.cache.get(key) for key in keys]
+    if all(solution is not None for solution in cached):
+      guesses[:] = cached
+      self.hits += len(keys)
+    else:
+      self.misses += len(keys)
+
+    thetas, converged = self.refine(targets, guesses)
+
+    for i in range(1, len(targets)):
+      step = np.abs(thetas[i] - thetas[i-1]).max()
+      if converged[i] and step <= max_step:
+        continue
+      retry, ok = self.refine(targets[i:i+1], thetas[i-1:i])
+      if ok[0] and (not converged[i] or np.abs(retry[0] - thetas[i-1]).max() < step):
+        thetas[i] = retry[0]
+        converged[i] = True
+
+    # most recently used solutions go to the end, the oldest get evicted
+    for i in np.flatnonzero(converged):
+      self.cache.pop(keys[i], None)
+      self.cache[keys[i]] = thetas[i].copy()
+    while len(self.cache) > self.cache_size:
+      self.cache.popitem(last=False)
+
+    return thetas, converged
+
+"""
+@function: large_steps
+@description: where a joint path jumps, with some joint moving more than
+max_step between one point and the next.
+@return: the index of the point after each jump
+"""
+def large_steps(path, max_step=IK_MAX_STEP):
+  path = np.asarray(path, dtype=np.float64)
+  return np.flatnonzero(np.abs(np.diff(path, axis=0)).max(axis=1) > max_step) + 1
+
+"""
+@class: JointLimits
+@description: joint limits for a whole arm, checked against an entire K x
+joints path in one go. Angles are in radians, with the hand last.
+"""
+class JointLimits(object):
+  def __init__(self, limits, hand=HAND_LIMITS):
+    table = np.radians(np.array(limits, dtype=np.float64))
+    if hand is not None:
+      table = np.vstack([table, hand])
+    self.lower = table[:, 0]
+    self.upper = table[:, 1]
+    self.soft_lower = self.lower + table[:, 2]
+    self.soft_upper = self.upper - table[:, 3]
+
+  """
+  @function: violations
+  @description: which joints of which points are past their limits.
+  @return: a K x joints boolean array
+  """
+  def violations(self, path):
+    path = np.asarray(path, dtype=np.float64)
+    joints = path.shape[-1]
+    return (path < self.lower[:joints]) | (path > self.upper[:joints])
+
+  """
+  @function: clamp
+  @description: hold every angle at least the soft margin inside its
+  limits. Angles are clipped, not snapped back, so a path running into a
+  limit follows it instead of jumping.
+  @return: the clamped path and which points were adjusted
+  """
+  def clamp(self, path):
+    path = np.asarray(path, dtype=np.float64)
+    joints = path.shape[-1]
+    clamped = np.clip(path, self.soft_lower[:joints], self.soft_upper[:joints])
+    return clamped, (clamped != path).any(axis=-1)
+
+  """
+  @function: check
+  @description: refuse a path with any angle past its limits.
+  @return: the path as an array
+  """
+  def check(self, path):
+    path = np.asarray(path, dtype=np.float64)
+    bad = np.flatnonzero(self.violations(path).any(axis=-1))
+    if len(bad):
+      raise ValueError('points ' + str(bad.tolist()) + ' are outside the joint limits')
+    return path
+
+"""
+@function: arm_limits
+@description: the joint limits of NAO's "RArm" or "LArm".
+@return: a JointLimits
+"""
+def arm_limits(effector):
+  return JointLimits(JOINT_LIMITS[effector])
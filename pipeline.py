@@ -0,0 +1,230 @@
+"""
+@file: pipeline.py
+@authors: Tommy Lin, TJ Maynes
+@subject: running capture, vision, planning and motion side by side, each on its own thread.
+"""
+
+import time, threading, Queue
+
+"""
+
+global variables
+
+"""
+# items waiting between two stages; a full queue holds up the stage before it
+PIPELINE_QUEUE_SIZE = 2
+
+# how often (seconds) a waiting stage checks whether it should stop
+POLL_INTERVAL = 0.1
+
+"""
+@class: Stage
+@description: one step of a Pipeline on its own thread. work is called
+with each item from the stage's input queue (or with no arguments, as
+fast as the next stage takes them, for the first stage) and whatever it
+returns goes on to the next stage. Returning None drops the item. Keeps
+counts of what it did, how long it took and how deep its queue got.
+"""
+class Stage(object):
+  def __init__(self, name, work, size=PIPELINE_QUEUE_SIZE):
+    self.name = name
+    self.work = work
+    self.size = size
+    self.input = None
+    self.next = None
+    self.processed = 0
+    self.dropped = 0
+    self.errors = 0
+    self.busy = 0.0
+    self.busy_max = 0.0
+    self.waited = 0.0
+    self.latency = 0.0
+    self.latency_max = 0.0
+    self.delivered = 0
+    self.max_depth = 0
+    self.failure = None
+    self._stopping = None
+    self._thread = None
+
+  def depth(self):
+    return 0 if self.input is None else self.input.qsize()
+
+  """
+  @function: put
+  @description: hand an item to this stage, waiting while its queue is full
+  (backpressure) unless the pipeline is stopping.
+  @return: whether the item was taken
+  """
+  def put(self, item):
+    while not self._stopping.is_set():
+      try:
+        self.input.put(item, timeout=POLL_INTERVAL)
+        self.max_depth = max(self.max_depth, self.input.qsize())
+        return True
+      except Queue.Full:
+        pass
+    return False
+
+  def _get(self):
+    while not self._stopping.is_set():
+      try:
+        return self.input.get(timeout=POLL_INTERVAL)
+      except Queue.Empty:
+        pass
+    return None
+
+  def start(self, stopping):
+    self._stopping = stopping
+    self._thread = threading.Thread(target=self._run, name="Stage " + self.name)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def join(self, timeout=None):
+    if self._thread is not None:
+      self._thread.join(timeout)
+
+  # anything that gets past _work's own error handling stops the whole
+  # pipeline, rather than leaving the other stages waiting on this one
+  def _run(self):
+    try:
+      self._work()
+    except Exception, e:
+      self.failure = e
+      print "Pipeline stage " + self.name + " died"
+      print "Error was: ", e
+      self._stopping.set()
+
+  def _work(self):
+    while not self._stopping.is_set():
+      if self.input is None:
+        stamp = None
+        args = ()
+      else:
+        queued = self._get()
+        if queued is None:
+          break
+        stamp, item, put_at = queued
+        self.waited += time.time() - put_at
+        args = (item,)
+
+      started = time.time()
+      try:
+        result = self.work(*args)
+      except Exception, e:
+        self.errors += 1
+        print "Pipeline stage " + self.name + " failed"
+        print "Error was: ", e
+        time.sleep(POLL_INTERVAL)
+        continue
+      finished = time.time()
+      self.busy += finished - started
+      self.busy_max = max(self.busy_max, finished - started)
+      self.processed += 1
+
+      # latency runs from the first stage starting on an item to the last
+      # stage finishing it
+      if stamp is None:
+        stamp = started
+      if result is None:
+        self.dropped += 1
+      elif self.next is not None:
+        self.next.put((stamp, result, finished))
+      else:
+        self.delivered += 1
+        self.latency += finished - stamp
+        self.latency_max = max(self.latency_max, finished - stamp)
+
+"""
+@class: Pipeline
+@description: stages connected by bounded queues, so while the arm draws
+one shape the camera, vision and planning stages are already working on
+the next. The first stage feeds itself; each later stage takes what the
+one before it returns.
+"""
+class Pipeline(object):
+  def __init__(self, stages):
+    self.stages = stages
+    for before, after in zip(stages, stages[1:]):
+      after.input = Queue.Queue(after.size)
+      before.next = after
+    self._stopping = threading.Event()
+    for stage in stages:
+      stage._stopping = self._stopping
+    self.started = None
+    self.stopped = None
+
+  def start(self):
+    self._stopping.clear()
+    self.started = time.time()
+    self.stopped = None
+    for stage in self.stages:
+      stage.start(self._stopping)
+    return self
+
+  """
+  @function: stopping
+  @description: whether the pipeline has been asked to stop, or a stage died.
+  """
+  def stopping(self):
+    return self._stopping.is_set()
+
+  """
+  @function: stop
+  @description: ask every stage to stop and wait for them. Items still on
+  the queues are thrown away; a stage stuck in its work gets timeout
+  seconds to finish it.
+  """
+  def stop(self, timeout=5.0):
+    self._stopping.set()
+    for stage in self.stages:
+      stage.join(timeout)
+    self.stopped = time.time()
+
+  """
+  @function: stats
+  @description: counters for every stage, in milliseconds.
+  @return: a list of dicts of "stage", "processed", "dropped", "errors",
+  "depth", "max_depth", "busy" and "waited" (mean time in the stage and
+  on its queue) and "busy_max"
+  """
+  def stats(self):
+    stats = []
+    for stage in self.stages:
+      processed = max(stage.processed, 1)
+      stats.append({
+        "stage": stage.name,
+        "processed": stage.processed,
+        "dropped": stage.dropped,
+        "errors": stage.errors,
+        "depth": stage.depth(),
+        "max_depth": stage.max_depth,
+        "busy": stage.busy / processed * 1000.0,
+        "busy_max": stage.busy_max * 1000.0,
+        "waited": stage.waited / processed * 1000.0,
+      })
+    return stats
+
+  """
+  @function: throughput
+  @description: how many items made it through the last stage, how many
+  per second and their mean and worst end to end latency (milliseconds).
+  @return: (delivered, per second, mean latency, max latency)
+  """
+  def throughput(self):
+    last = self.stages[-1]
+    elapsed = (self.stopped or time.time()) - self.started
+    mean = last.latency / last.delivered * 1000.0 if last.delivered else 0.0
+    return last.delivered, last.delivered / max(elapsed, 1e-9), mean, last.latency_max * 1000.0
+
+  """
+  @function: report
+  @description: print the stage counters.
+  """
+  def report(self):
+    print "%-10s %9s %8s %7s %6s %10s %10s %10s" % ("stage", "processed", "dropped", "errors", "depth", "busy (ms)", "max (ms)", "queue (ms)")
+    for s in self.stats():
+      print "%-10s %9d %8d %7d %3d/%-2d %10.2f %10.2f %10.2f" % (s["stage"], s["processed"], s["dropped"], s["errors"],
+                                                              s["depth"], s["max_depth"], s["busy"], s["busy_max"], s["waited"])
+    delivered, rate, mean, worst = self.throughput()
+    print "%d through in %.2f s (%.2f per second), latency %.2f ms mean, %.2f ms max" % (
+      delivered, (self.stopped or time.time()) - self.started, rate, mean, worst)
@@ -0,0 +1,116 @@
+"""
+@file: planfile.py
+@authors: Tommy Lin, TJ Maynes
+@subject: saving drawing plans to disk and replaying them without redoing vision.
+"""
+
+import struct
+import numpy as np
+import trajectory
+
+"""
+
+global variables
+
+"""
+# a plan file is a HEADER_SIZE byte header, then a table of segments (one
+# per shape: first waypoint, number of waypoints, arm, whether it is
+# timed), then every waypoint's joint angles and time as float32, all
+# little endian
+MAGIC = "NAOPLAN\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHHHHII")
+HEADER_SIZE = 32
+SEGMENT_FIELDS = 4
+
+# arms by the number they are stored as
+ARMS = ["RArm", "LArm"]
+
+"""
+@function: write_plan
+@description: save planned paths, a list of (path, times, effector) like
+plan_path gives, to a plan file. Untimed paths get NaN times.
+"""
+def write_plan(path, paths):
+  joints = max([np.shape(p[0])[1] for p in paths] or [6])
+  counts = [len(p[0]) for p in paths]
+  firsts = np.cumsum([0] + counts)[:-1]
+  segments = np.array([[first, count, ARMS.index(effector), times is not None]
+                       for first, count, (joint_path, times, effector) in zip(firsts, counts, paths)],
+                      dtype='<u4').reshape(-1, SEGMENT_FIELDS)
+
+  waypoints = np.full((sum(counts), joints + 1), np.nan, dtype='<f4')
+  for first, count, (joint_path, times, effector) in zip(firsts, counts, paths):
+    joint_path = np.asarray(joint_path)
+    waypoints[first:first + count, :joint_path.shape[1]] = joint_path
+    if times is not None:
+      waypoints[first:first + count, -1] = times
+
+  f = open(path, 'wb')
+  f.write(HEADER.pack(MAGIC, VERSION, HEADER_SIZE, 0, joints, len(segments), len(waypoints)).ljust(HEADER_SIZE, "\0"))
+  f.write(segments.tostring())
+  f.write(waypoints.tostring())
+  f.close()
+
+"""
+@class: PlanFile
+@description: a plan file, memory-mapped. Nothing is read until a segment
+is asked for, and then only that segment's pages, so opening a plan is
+instant and a library of them costs next to no memory.
+"""
+class PlanFile(object):
+  def __init__(self, path):
+    self.path = path
+    self._data = np.memmap(path, dtype=np.uint8, mode='r')
+    if len(self._data) < HEADER_SIZE:
+      raise ValueError(path + ' is not a plan file')
+    magic, version, header_size, flags, joints, segments, waypoints = HEADER.unpack(self._data[:HEADER.size].tostring())
+    if magic != MAGIC:
+      raise ValueError(path + ' is not a plan file')
+    if version != VERSION:
+      raise ValueError('%s is a version %d plan, only version %d can be read' % (path, version, VERSION))
+    self.version = version
+    self.joints = joints
+
+    table = header_size + segments * SEGMENT_FIELDS * 4
+    if len(self._data) != table + waypoints * (joints + 1) * 4:
+      raise ValueError(path + ' is cut short')
+    self.segments = self._data[header_size:table].view('<u4').reshape(segments, SEGMENT_FIELDS)
+    self.waypoints = self._data[table:].view('<f4').reshape(waypoints, joints + 1)
+
+  def __len__(self):
+    return len(self.segments)
+
+  """
+  @function: segment
+  @description: one shape of the plan, as views into the file.
+  @return: the joint path (K x joints), times (K, or None) and effector
+  """
+  def segment(self, n):
+    first, count, arm, timed = self.segments[n]
+    rows = self.waypoints[first:first + count]
+    return rows[:, :self.joints], (rows[:, -1] if timed else None), ARMS[arm]
+
+  def __iter__(self):
+    for n in range(len(self)):
+      yield self.segment(n)
+
+  def close(self):
+    self._data = None
+    self.segments = None
+    self.waypoints = None
+
+"""
+@function: replay
+@description: draw a plan file, shape after shape, straight from the file.
+The file has no pixels to keep two arms apart with, so even a plan for
+both arms is drawn one shape at a time.
+@return: the MotionHandle of the last shape, or None for an empty plan
+"""
+def replay(plan, proxy):
+  drawing = None
+  for joint_path, times, effector in plan:
+    if drawing is not None:
+      drawing.wait()
+    drawing = trajectory.TrajectoryExecutor(proxy, effector).execute(joint_path, times=times)
+  return drawing
@@ -0,0 +1,250 @@
+"""
+@file: planning.py
+@authors: Tommy Lin, TJ Maynes
+@subject: picking which contours NAO draws and in what order.
+"""
+
+import time
+import numpy as np
+import cv2
+import instrument
+
+"""
+
+global variables
+
+"""
+# contours shorter or smaller than this (pixels) are noise
+MIN_CONTOUR_LENGTH = 40
+MIN_CONTOUR_AREA = 100
+
+# approxPolyDP tolerance, as a fraction of each contour's arc length
+SIMPLIFY_TOLERANCE = 0.1
+
+# contours whose bounding boxes are this close (pixels) are the inside and
+# outside edge of the same stroke, so only one of them gets drawn
+DUPLICATE_DISTANCE = 15
+
+# most reversals 2-opt makes before settling for what it has, how many of
+# each point's nearest neighbours it tries to join it up with, and the most
+# time (seconds) it spends on a busy card
+TWO_OPT_MOVES = 200
+TWO_OPT_NEIGHBOURS = 8
+TWO_OPT_TIME = 0.01
+
+# drawing paths get a point at least every this many pixels along each edge
+PATH_SPACING = 4
+
+# where the card is split between NAO's arms (pixels), and how far past
+# that line each arm may reach to even out the work
+ARM_MIDDLE = 320
+ARM_REACH = 160
+
+"""
+@function: keep_contours
+@description: which contours are worth drawing: not noise, and each
+stroke only once.
+@return: their indices
+"""
+def keep_contours(contours, min_length=MIN_CONTOUR_LENGTH, min_area=MIN_CONTOUR_AREA,
+                  duplicate_distance=DUPLICATE_DISTANCE):
+  keep = [k for k, cnt in enumerate(contours) if cv2.arcLength(cnt, True) >= min_length and cv2.contourArea(cnt) >= min_area]
+  if not keep:
+    return []
+
+  # a contour is a duplicate if an earlier one has nearly the same bounding
+  # box (one side at a time, in small ints, as a busy card has hundreds)
+  boxes = np.array([cv2.boundingRect(contours[k]) for k in keep])
+  boxes[:, 2:] += boxes[:, :2]
+  boxes = boxes.astype(np.int16)
+  close = np.ones((len(keep), len(keep)), dtype=bool)
+  for side in range(4):
+    close &= np.abs(np.subtract.outer(boxes[:, side], boxes[:, side])) <= duplicate_distance
+  duplicate = np.tril(close, -1).any(axis=1)
+  return [k for k, dup in zip(keep, duplicate) if not dup]
+
+"""
+@function: simplify
+@description: simplify contours (the ones keep_contours picked) with
+approxPolyDP.
+@return: a list of N x 1 x 2 polygons, like approxPolyDP gives
+"""
+def simplify(contours, tolerance=SIMPLIFY_TOLERANCE):
+  with instrument.span("approxPolyDP"):
+    return [cv2.approxPolyDP(cnt, tolerance*cv2.arcLength(cnt, True), True) for cnt in contours]
+
+"""
+@function: nearest_neighbour
+@description: greedy order: from the pen's position, go to the closest
+vertex of any contour not drawn yet, draw that contour from there (ending
+back at the same vertex) and repeat.
+@return: the order of the contours and the vertex each one starts at
+"""
+def nearest_neighbour(polygons, start):
+  vertices = np.vstack([p.reshape(-1, 2) for p in polygons]).astype(np.float64)
+  x = vertices[:, 0].copy()
+  y = vertices[:, 1].copy()
+  owner = np.repeat(np.arange(len(polygons)), [len(p) for p in polygons])
+  first = np.cumsum([0] + [len(p) for p in polygons])
+
+  # vertices of contours already drawn are infinitely far away
+  drawn = np.zeros(len(vertices))
+
+  order = []
+  starts = []
+  px, py = start
+  for n in range(len(polygons)):
+    nearest = ((x - px) ** 2 + (y - py) ** 2 + drawn).argmin()
+    contour = owner[nearest]
+    order.append(contour)
+    starts.append(nearest - first[contour])
+    drawn[first[contour]:first[contour + 1]] = np.inf
+    px, py = x[nearest], y[nearest]
+  return order, starts
+
+"""
+@function: two_opt
+@description: improve an open tour through points (points[0] is where the
+pen starts and stays first) by reversing stretches of it while that
+shortens the total travel. Each round scores, all at once, the reversals
+that would bring a point next to one of its nearest neighbours, and makes
+the best one. It stops after moves rounds or seconds, whichever is first.
+@return: the improved order of points[1:]
+"""
+def two_opt(points, moves=TWO_OPT_MOVES, neighbours=TWO_OPT_NEIGHBOURS, seconds=TWO_OPT_TIME):
+  points = np.asarray(points, dtype=np.float64)
+  n = len(points)
+  if n < 3:
+    return np.arange(n)[1:] - 1
+  squares = (points ** 2).sum(axis=1)
+  distance = np.sqrt(np.maximum(squares[:, None] + squares[None, :] - 2.0 * points.dot(points.T), 0.0))
+
+  # each point's nearest neighbours, not counting itself
+  neighbours = min(neighbours, n - 1)
+  diagonal = np.arange(n)
+  distance[diagonal, diagonal] = np.inf
+  nearest = np.argpartition(distance, neighbours - 1, axis=1)[:, :neighbours]
+  distance[diagonal, diagonal] = 0.0
+  deadline = time.time() + seconds
+  tour = np.arange(n)
+  position = np.arange(n)
+
+  # reversing tour[i..j] swaps edges (i-1, i) and (j, j+1) for (i-1, j) and (i, j+1)
+  i = np.arange(1, n)[:, None]
+  for move in range(moves):
+    if time.time() > deadline:
+      break
+    a = tour[i - 1]
+    b = tour[i]
+    c = nearest[a[:, 0]]
+    j = position[c]
+    d = tour[np.minimum(j + 1, n - 1)]
+    delta = distance[a, c] - distance[a, b] + np.where(j + 1 < n, distance[b, d] - distance[c, d], 0.0)
+    delta[j <= i] = 0.0
+    best = np.unravel_index(delta.argmin(), delta.shape)
+    if delta[best] >= -1e-9:
+      break
+    start, end = i[best[0], 0], j[best]
+    tour[start:end + 1] = tour[start:end + 1][::-1].copy()
+    position[tour] = np.arange(n)
+  return tour[1:] - 1
+
+"""
+@function: contour_order
+@description: order the polygons and pick where each one starts so the arm
+spends as little time as possible moving between shapes: nearest
+neighbour first, then 2-opt on the result.
+@return: a list of (index into polygons, vertex it starts at)
+"""
+@instrument.timed("order_contours")
+def contour_order(polygons, start=(0, 0)):
+  if not polygons:
+    return []
+  order, starts = nearest_neighbour(polygons, start)
+  entries = [polygons[c].reshape(-1, 2)[s] for c, s in zip(order, starts)]
+  tour = two_opt(np.vstack([np.asarray(start, dtype=np.float64)[None, :], entries]))
+  return [(order[t], starts[t]) for t in tour]
+
+"""
+@function: travel
+@description: how far (pixels) the pen moves between shapes for a plan.
+@return: the total distance
+"""
+def travel(polygons, start=(0, 0)):
+  if not polygons:
+    return 0.0
+  entries = np.vstack([np.asarray(start, dtype=np.float64)[None, :]] + [p.reshape(-1, 2)[:1] for p in polygons])
+  return np.sqrt((np.diff(entries, axis=0) ** 2).sum(axis=1)).sum()
+
+"""
+@function: resample
+@description: points along a closed polygon every spacing pixels (or a
+little closer, so each edge splits evenly), starting at its first vertex
+and not coming back to it. The corners are always kept.
+@return: the points (N x 2) and whether each one is a corner (N)
+"""
+def resample(polygon, spacing=PATH_SPACING):
+  vertices = polygon.reshape(-1, 2).astype(np.float64)
+
+  # drop repeated vertices, they make edges with no length
+  lengths = np.sqrt(((np.roll(vertices, -1, axis=0) - vertices) ** 2).sum(axis=1))
+  if not (lengths > 0).any():
+    return vertices[:1], np.ones(1, dtype=bool)
+  vertices = vertices[lengths > 0]
+  lengths = lengths[lengths > 0]
+  ends = np.roll(vertices, -1, axis=0)
+
+  steps = np.ceil(lengths / spacing).astype(int)
+  edge = np.repeat(np.arange(len(vertices)), steps)
+  first = np.cumsum(steps) - steps
+  fraction = (np.arange(steps.sum()) - first[edge]) / steps[edge].astype(np.float64)
+  points = vertices[edge] + fraction[:, None] * (ends - vertices)[edge]
+  return points, fraction == 0
+
+"""
+@function: split_arms
+@description: which arm draws each polygon. Shapes on the left of the
+card go to the left arm and shapes on the right to the right arm, except
+that the split is moved (no further than reach past middle) to where both
+arms have about as much outline to draw.
+@return: "LArm" or "RArm" for each polygon
+"""
+def split_arms(polygons, middle=ARM_MIDDLE, reach=ARM_REACH):
+  if not polygons:
+    return []
+  centres = np.array([p.reshape(-1, 2)[:, 0].mean() for p in polygons])
+  lengths = np.array([cv2.arcLength(p, True) for p in polygons])
+  order = np.argsort(centres, kind="mergesort")
+
+  # the first k shapes from the left go to the left arm
+  left = np.concatenate([[0.0], np.cumsum(lengths[order])])
+  work = np.maximum(left, left[-1] - left)
+  k = np.arange(len(polygons) + 1)
+  sorted_centres = np.concatenate([[-np.inf], centres[order], [np.inf]])
+  allowed = (sorted_centres[k] < middle + reach) & (sorted_centres[k + 1] > middle - reach)
+  if not allowed.any():
+    allowed = (sorted_centres[k] < middle) & (sorted_centres[k + 1] >= middle)
+  split = k[allowed][work[allowed].argmin()]
+
+  arms = np.array(["RArm"] * len(polygons), dtype=object)
+  arms[order[:split]] = "LArm"
+  return arms.tolist()
+
+"""
+@function: plan_contours
+@description: everything robo_vision needs from a frame's contours: which
+ones to draw, simplified, in the order to draw them. With classify, each
+one is also named from its contour before it was simplified.
+@return: a list of N x 1 x 2 polygons (and, with classify, their names)
+"""
+def plan_contours(contours, start=(0, 0), tolerance=SIMPLIFY_TOLERANCE, classify=None, min_length=MIN_CONTOUR_LENGTH,
+                  min_area=MIN_CONTOUR_AREA, duplicate_distance=DUPLICATE_DISTANCE):
+  keep = keep_contours(contours, min_length, min_area, duplicate_distance)
+  polygons = simplify([contours[k] for k in keep], tolerance)
+  order = contour_order(polygons, start)
+
+  # each polygon rotated to start at its entry vertex
+  polygons = [np.concatenate((polygons[c][s:], polygons[c][:s])) for c, s in order]
+  if classify is None:
+    return polygons
+  return polygons, [classify(contours[keep[c]]) for c, s in order]
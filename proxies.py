@@ -0,0 +1,172 @@
+"""
+@file: proxies.py
+@authors: Tommy Lin, TJ Maynes
+@subject: connecting to NAO's modules lazily, once, and again when the link drops.
+"""
+
+import time, socket, threading
+import instrument
+
+"""
+
+global variables
+
+"""
+# how many times to try creating a proxy, and how long to wait (seconds)
+# before the second try; the wait doubles after every failure
+RECONNECT_ATTEMPTS = 4
+RECONNECT_BACKOFF = 0.5
+
+# NAOqi reports a lost link as a RuntimeError like any other, so these bits
+# of its message (lower case) are how a dropped connection is recognised
+CONNECTION_ERRORS = ("cannot connect", "connection", "socket", "broken pipe", "network", "timed out")
+
+"""
+@function: connection_error
+@description: whether an error means the link to NAO failed, as opposed to
+the module itself refusing or failing the call. Only these are worth
+reconnecting and trying again for.
+@return: True for a connection or transport failure
+"""
+def connection_error(e):
+  if isinstance(e, (socket.error, EOFError, IOError)):
+    return True
+  return isinstance(e, RuntimeError) and any(marker in str(e).lower() for marker in CONNECTION_ERRORS)
+
+"""
+@class: ProxyPool
+@description: one proxy per NAOqi module for the whole session. Proxies are
+created the first time they are asked for (or in the background with
+prefetch), and created again with backoff after being dropped.
+"""
+class ProxyPool(object):
+  def __init__(self, make_proxy, ip, port, attempts=RECONNECT_ATTEMPTS, backoff=RECONNECT_BACKOFF):
+    self.make_proxy = make_proxy
+    self.ip = ip
+    self.port = port
+    self.attempts = attempts
+    self.backoff = backoff
+    self._proxies = {}
+    self._locks = {}
+    self._lock = threading.Lock()
+
+  def _module_lock(self, name):
+    with self._lock:
+      return self._locks.setdefault(name, threading.Lock())
+
+  """
+  @function: get
+  @description: the proxy to a module, connecting first if we have to. Only
+  one thread connects to a module at a time; the others wait for it.
+  @return: the proxy
+  """
+  def get(self, name):
+    proxy = self._proxies.get(name)
+    if proxy is not None:
+      return proxy
+    with self._module_lock(name):
+      proxy = self._proxies.get(name)
+      if proxy is None:
+        proxy = self._connect(name)
+        self._proxies[name] = proxy
+      return proxy
+
+  def _connect(self, name):
+    delay = self.backoff
+    for attempt in range(self.attempts):
+      try:
+        return self.make_proxy(name, self.ip, self.port)
+      except Exception, e:
+        if attempt == self.attempts - 1 or not connection_error(e):
+          raise
+        time.sleep(delay)
+        delay *= 2
+
+  """
+  @function: drop
+  @description: forget a module's proxy so the next use connects again.
+  """
+  def drop(self, name):
+    self._proxies.pop(name, None)
+
+  """
+  @function: prefetch
+  @description: start connecting to modules in the background, all at once,
+  so they are ready (or failed) by the time they are first used.
+  """
+  def prefetch(self, names):
+    for name in names:
+      thread = threading.Thread(target=self._prefetch, args=(name,), name="connect " + name)
+      thread.daemon = True
+      thread.start()
+
+  def _prefetch(self, name):
+    try:
+      self.get(name)
+    except Exception, e:
+      print "Could not create proxy to " + name
+      print "Error was: ", e
+
+  """
+  @function: proxy
+  @description: a stand-in for a module's proxy that connects on first use.
+  @return: a LazyProxy
+  """
+  def proxy(self, name):
+    return LazyProxy(self, name)
+
+"""
+@class: LazyProxy
+@description: looks like an ALProxy, but only connects when a method is
+first called. If a call fails because the connection did, the proxy is
+dropped, reconnected and the call tried once more before giving up. Any
+other error is the module's answer and is raised as it is.
+"""
+class LazyProxy(object):
+  def __init__(self, pool, name):
+    self._pool = pool
+    self._name = name
+
+  def __getattr__(self, attr):
+    if attr == "post":
+      return _LazyPost(self._pool, self._name)
+    value = getattr(self._pool.get(self._name), attr)
+    if attr.startswith("_") or not callable(value):
+      return value
+
+    pool = self._pool
+    name = self._name
+    label = name + "." + attr
+    def call(*args):
+      with instrument.span(label):
+        try:
+          return getattr(pool.get(name), attr)(*args)
+        except Exception, e:
+          if not connection_error(e):
+            raise
+          pool.drop(name)
+          return getattr(pool.get(name), attr)(*args)
+    return call
+
+# proxy.post.method(...) on a LazyProxy, with the same retry
+class _LazyPost(object):
+  def __init__(self, pool, name):
+    self._pool = pool
+    self._name = name
+
+  def __getattr__(self, attr):
+    if attr.startswith("_"):
+      raise AttributeError(attr)
+    pool = self._pool
+    name = self._name
+    label = name + ".post." + attr
+    def call(*args):
+      with instrument.span(label):
+        try:
+          return getattr(pool.get(name).post, attr)(*args)
+        except Exception, e:
+          if not connection_error(e):
+            raise
+          pool.drop(name)
+          return getattr(pool.get(name).post, attr)(*args)
+    return call
@@ -0,0 +1,107 @@
+"""
+@file: robocommands.py
+@authors: Tommy Lin, TJ Maynes
+@subject: speaking, changing posture and stiffening NAO without waiting for it.
+"""
+
+import time, threading
+import instrument
+
+"""
+
+global variables
+
+"""
+# post commands so they run alongside everything else (False waits for
+# each one to finish before going on, like calling the module directly)
+overlap = True
+
+"""
+@class: Task
+@description: a command that has been posted to a NAOqi module. done()
+checks on it without blocking and wait() blocks until it has finished.
+A thread follows the task so the instruments (and their timeline) know
+when it really finished, not just when someone got round to waiting for it.
+"""
+class Task(object):
+  def __init__(self, proxy, name, task_id=None, started=None):
+    self.proxy = proxy
+    self.name = name
+    self.task_id = task_id
+    self.started = time.time() if started is None else started
+    self.finished = None
+    self._done = threading.Event()
+    if task_id is None:
+      self._finish()
+    else:
+      thread = threading.Thread(target=self._follow, name="Task " + name)
+      thread.daemon = True
+      thread.start()
+
+  def _follow(self):
+    try:
+      # NAOqi's wait takes its timeout in milliseconds, 0 meaning forever
+      self.proxy.wait(self.task_id, 0)
+    except Exception, e:
+      print "Lost track of " + self.name
+      print "Error was: ", e
+    self._finish()
+
+  def _finish(self):
+    self.finished = time.time()
+    instrument.event(self.name, self.started, self.finished)
+    self._done.set()
+
+  def done(self):
+    return self._done.is_set()
+
+  def wait(self, timeout=None):
+    self._done.wait(timeout)
+    return self._done.is_set()
+
+"""
+@function: post
+@description: start proxy.method(*args) on the robot and return straight
+away (or, without overlap, call it and return once it is done).
+@return: a Task
+"""
+def post(proxy, method, *args):
+  name = method + "(" + (repr(args[0]) if args else "") + ")"
+  started = time.time()
+  if not overlap:
+    getattr(proxy, method)(*args)
+    return Task(proxy, name, started=started)
+  return Task(proxy, name, getattr(proxy.post, method)(*args), started)
+
+"""
+@function: say
+@description: start NAO saying text.
+@return: a Task
+"""
+def say(voice, text):
+  return post(voice, "say", text)
+
+"""
+@function: go_to_posture
+@description: start NAO going to one of ALRobotPosture's postures.
+@return: a Task
+"""
+def go_to_posture(posture, name, speed=0.5):
+  return post(posture, "goToPosture", name, speed)
+
+"""
+@function: stiffen
+@description: set the stiffness of every one of effectors at once.
+@return: a list of Tasks, one per effector
+"""
+def stiffen(motion, effectors, stiffness=1.0):
+  return [post(motion, "setStiffnesses", effector, stiffness) for effector in effectors]
+
+"""
+@function: wait_all
+@description: block until every task given (None is skipped) has finished.
+"""
+def wait_all(tasks):
+  for task in tasks:
+    if task is not None:
+      task.wait()
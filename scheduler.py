@@ -0,0 +1,170 @@
+"""
+@file: scheduler.py
+@authors: Tommy Lin, TJ Maynes
+@subject: drawing with both of NAO's arms at once without them running into each other.
+"""
+
+import sys, time, threading
+import numpy as np
+import trajectory
+
+"""
+
+global variables
+
+"""
+# the parts of the card both arms are working on must stay this far apart (pixels)
+ARM_GAP = 40
+
+"""
+@function: bounding_box
+@description: the box around a polygon and, if given, the point the pen
+comes from, so the move to the shape is covered too.
+@return: (x0, y0, x1, y1) in pixels
+"""
+def bounding_box(polygon, start=None):
+  points = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+  if start is not None:
+    points = np.vstack([points, np.asarray(start, dtype=np.float64)[None, :]])
+  return tuple(points.min(axis=0)) + tuple(points.max(axis=0))
+
+"""
+@function: too_close
+@description: whether two boxes come within gap pixels of each other.
+@return: True if they do
+"""
+def too_close(a, b, gap=ARM_GAP):
+  return a[0] - gap < b[2] and b[0] - gap < a[2] and a[1] - gap < b[3] and b[1] - gap < a[3]
+
+"""
+@class: ArmScheduler
+@description: draws shapes with both arms at the same time, each arm on
+its own thread working through its own shapes in order. Before an arm
+starts a shape it waits until the other arm isn't drawing anywhere near
+it (in pixel space, including the move over to the shape). Between shapes
+an arm's pen stays parked on the card, so that spot stays reserved until
+the arm is granted its next shape, or moves back to where it started
+because the other arm needs the spot.
+"""
+class ArmScheduler(object):
+  def __init__(self, proxy, gap=ARM_GAP):
+    self.proxy = proxy
+    self.gap = gap
+    self.busy = {}
+    self.wanted = {}
+    self.drawing = set()
+    self.failures = {}
+    self.waited = {}
+    self.drawn = {}
+    self._changed = threading.Condition()
+
+  """
+  @function: run
+  @description: draw every shape and wait until both arms are done. shapes
+  is a list of (polygon, (path, times, effector)) from plan_path. If either
+  arm fails, its error is raised here once both have stopped.
+  @return: seconds it took
+  """
+  def run(self, shapes):
+    jobs = {}
+    for polygon, planned in shapes:
+      jobs.setdefault(planned[2], []).append((polygon, planned))
+
+    started = time.time()
+    self.drawing = set(jobs)
+    self.failures = {}
+    threads = []
+    for effector, arm_jobs in jobs.items():
+      thread = threading.Thread(target=self._draw, args=(effector, arm_jobs), name="ArmScheduler " + effector)
+      thread.daemon = True
+      thread.start()
+      threads.append(thread)
+    for thread in threads:
+      thread.join()
+    for effector in sorted(self.failures):
+      failure = self.failures[effector]
+      raise failure[0], failure[1], failure[2]
+    return time.time() - started
+
+  # caller holds self._changed
+  def _clear(self, effector, box):
+    for other, other_box in self.busy.items():
+      if other != effector and too_close(box, other_box, self.gap):
+        return False
+    return True
+
+  # caller holds self._changed: whether what effector holds is wanted by the other arm
+  def _in_the_way(self, effector):
+    held = self.busy.get(effector)
+    if held is None:
+      return False
+    for other, box in self.wanted.items():
+      if other != effector and too_close(held, box, self.gap):
+        return True
+    return False
+
+  def _draw(self, effector, jobs):
+    self.waited[effector] = 0.0
+    self.drawn[effector] = 0
+    try:
+      executor = trajectory.TrajectoryExecutor(self.proxy, effector)
+      home = self.proxy.getAngles(effector, True)
+      pen = None
+      for polygon, (path, times, arm) in jobs:
+        pen = self._claim(effector, polygon, pen, executor, home)
+        executor.execute(path, times=times).wait()
+        self.drawn[effector] += 1
+
+        # the pen stops where the shape started, and stays there for now
+        pen = np.asarray(polygon).reshape(-1, 2)[0]
+        with self._changed:
+          self.busy[effector] = bounding_box([pen])
+          self._changed.notify_all()
+
+      # keep the spot until the other arm is done too, or needs it
+      with self._changed:
+        self.drawing.discard(effector)
+        self._changed.notify_all()
+        while self.drawing and not self._in_the_way(effector):
+          self._changed.wait()
+        in_the_way = bool(self.drawing)
+      if in_the_way:
+        self._retract(effector, executor, home)
+    except Exception:
+      self.failures[effector] = sys.exc_info()
+    finally:
+      with self._changed:
+        self.drawing.discard(effector)
+        self.busy.pop(effector, None)
+        self.wanted.pop(effector, None)
+        self._changed.notify_all()
+
+  """
+  @function: _claim
+  @description: wait until the part of the card polygon (and the move over
+  from the parked pen) covers is clear, and reserve it. If the other arm
+  is waiting on the parked pen meanwhile, this arm moves back home first.
+  @return: where the pen is now (None once it has gone home)
+  """
+  def _claim(self, effector, polygon, pen, executor, home):
+    asked = time.time()
+    while True:
+      box = bounding_box(polygon, pen)
+      with self._changed:
+        self.wanted[effector] = box
+        self._changed.notify_all()
+        while not self._clear(effector, box) and not self._in_the_way(effector):
+          self._changed.wait()
+        if self._clear(effector, box):
+          del self.wanted[effector]
+          self.busy[effector] = box
+          self.waited[effector] += time.time() - asked
+          return pen
+      self._retract(effector, executor, home)
+      pen = None
+
+  def _retract(self, effector, executor, home):
+    executor.execute([home]).wait()
+    with self._changed:
+      self.busy.pop(effector, None)
+      self._changed.notify_all()
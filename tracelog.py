@@ -0,0 +1,122 @@
+"""
+@file: tracelog.py
+@authors: Tommy Lin, TJ Maynes
+@subject: logging pixels and joint angles to disk without slowing NAO down.
+"""
+
+import time, json, atexit, threading, Queue
+import numpy as np
+
+"""
+
+global variables
+
+"""
+# most records written in one go, and longest a record waits (seconds)
+BATCH_SIZE = 512
+FLUSH_INTERVAL = 1.0
+
+# paths waiting to be written before new ones get dropped
+TRACE_QUEUE_SIZE = 1024
+
+"""
+@class: TraceLogger
+@description: a background thread that writes trace records as JSON lines,
+one per point: {"time", "source", "arm", "pixel", "joints"}. Callers only
+put the arrays on a queue; formatting and writing happen in batches on
+the logger's thread.
+"""
+class TraceLogger(object):
+  def __init__(self, path, enabled=True, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+    self.path = path
+    self.enabled = enabled
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.written = 0
+    self.dropped = 0
+    self._queue = Queue.Queue(TRACE_QUEUE_SIZE)
+    self._thread = None
+    self._lock = threading.Lock()
+
+  """
+  @function: log
+  @description: queue a trace of joints (N x joints) reached for pixels
+  (N x 2, or None when there is no pixel) by source.
+  """
+  def log(self, source, pixels, joints, arm="RArm"):
+    if not self.enabled:
+      return
+    self._start()
+    try:
+      self._queue.put_nowait((time.time(), source, arm, pixels, joints))
+    except Queue.Full:
+      self.dropped += 1
+
+  """
+  @function: flush
+  @description: wait until everything logged so far is on disk.
+  """
+  def flush(self):
+    if self._thread is not None:
+      self._queue.join()
+
+  def _start(self):
+    with self._lock:
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name="TraceLogger")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.flush)
+
+  def _run(self):
+    while True:
+      batch = [self._queue.get()]
+      deadline = time.time() + self.flush_interval
+      while len(batch) < self.batch_size:
+        try:
+          batch.append(self._queue.get(timeout=max(0.0, deadline - time.time())))
+        except Queue.Empty:
+          break
+      try:
+        self._write(batch)
+      except Exception, e:
+        print "Could not write trace to " + self.path
+        print "Error was: ", e
+      finally:
+        for item in batch:
+          self._queue.task_done()
+
+  def _write(self, batch):
+    lines = []
+    for stamp, source, arm, pixels, joints in batch:
+      joints = np.asarray(joints, dtype=np.float64).reshape(-1, np.shape(joints)[-1]).tolist()
+      if pixels is None:
+        pixels = [None] * len(joints)
+      else:
+        pixels = np.asarray(pixels).reshape(-1, 2).tolist()
+      for pixel, thetas in zip(pixels, joints):
+        lines.append(json.dumps({"time": stamp, "source": source, "arm": arm, "pixel": pixel, "joints": thetas}))
+    f = open(self.path, 'a')
+    f.write("\n".join(lines) + "\n")
+    f.close()
+    self.written += len(lines)
+
+"""
+@function: read_trace
+@description: load a trace written by TraceLogger into numpy arrays.
+Points without a pixel get NaN for x and y.
+@return: a dict of "time" (N), "source" (N), "arm" (N), "pixel" (N x 2)
+and "joints" (N x joints)
+"""
+def read_trace(path, source=None):
+  records = [json.loads(line) for line in open(path) if line.strip()]
+  if source is not None:
+    records = [r for r in records if r["source"] == source]
+  nan = [float('nan'), float('nan')]
+  return {
+    "time": np.array([r["time"] for r in records], dtype=np.float64),
+    "source": np.array([r["source"] for r in records]),
+    "arm": np.array([r["arm"] for r in records]),
+    "pixel": np.array([r["pixel"] if r["pixel"] is not None else nan for r in records], dtype=np.float64).reshape(-1, 2),
+    "joints": np.array([r["joints"] for r in records], dtype=np.float64),
+  }
@@ -0,0 +1,171 @@
+"""
+@file: trajectory.py
+@authors: Tommy Lin, TJ Maynes
+@subject: sending whole joint paths to NAO's arms as timed trajectories.
+"""
+
+import time
+import numpy as np
+
+"""
+
+global variables
+
+"""
+# joints in each arm chain, in the order getAngles and lookup_table use
+ARM_JOINTS = {
+  "RArm": ["RShoulderPitch", "RShoulderRoll", "RElbowYaw", "RElbowRoll", "RWristYaw", "RHand"],
+  "LArm": ["LShoulderPitch", "LShoulderRoll", "LElbowYaw", "LElbowRoll", "LWristYaw", "LHand"],
+}
+
+# fastest we let any joint move while drawing (radians per second)
+MAX_JOINT_SPEED = 1.0
+
+# shortest time we give any single segment (seconds)
+MIN_SEGMENT_TIME = 0.1
+
+# fastest the pen moves along an edge of a resampled path (pixels per
+# second) and how quickly it gets there (pixels per second squared)
+PEN_SPEED = 1000.0
+PEN_ACCEL = 5000.0
+
+"""
+@function: path_times
+@description: time stamps for each point of a joint path, so that the joint
+that has to travel furthest in each segment moves at max_speed. If start is
+given, the first segment is timed from there instead of from path[0].
+@return: an array of strictly increasing times in seconds, one per point
+"""
+def path_times(path, start=None, max_speed=MAX_JOINT_SPEED, min_time=MIN_SEGMENT_TIME):
+  path = np.asarray(path, dtype=np.float64)
+  if start is None:
+    start = path[0]
+  previous = np.vstack([np.asarray(start, dtype=np.float64)[None, :path.shape[1]], path[:-1]])
+  distance = np.abs(path - previous).max(axis=1)
+  return np.cumsum(np.maximum(distance / max_speed, min_time))
+
+"""
+@function: trapezoid_times
+@description: time stamps for a resampled closed path (from
+planning.resample) where the pen starts from rest at every corner,
+speeds up at accel to speed, and slows down again to stop at the next
+corner. speed can also be one speed per edge (see pen_speeds). Edges too
+short to reach speed get a triangle instead.
+@return: N + 1 times in seconds from 0, the last one for getting back
+to the first point
+"""
+def trapezoid_times(points, corners, speed=PEN_SPEED, accel=PEN_ACCEL):
+  points = np.asarray(points, dtype=np.float64)
+  closed = np.vstack([points, points[:1]])
+  distance = np.concatenate([[0.0], np.cumsum(np.sqrt((np.diff(closed, axis=0) ** 2).sum(axis=1)))])
+
+  # which edge each point is on, and how far along it
+  stops = np.concatenate([corners, [True]])
+  stops[0] = True
+  edge = np.cumsum(stops) - 1
+  corner_distance = distance[stops]
+  lengths = np.concatenate([np.diff(corner_distance), [0.0]])
+  along = distance - corner_distance[edge]
+  length = lengths[edge]
+  speed = np.append(np.zeros(len(lengths) - 1) + speed, 1.0)
+
+  # distance spent speeding up (and again slowing down), top speed reached
+  # and time to cover each edge
+  ramp = np.minimum(speed ** 2 / (2.0 * accel), lengths / 2.0)
+  peak = np.maximum(np.sqrt(2.0 * accel * ramp), 1e-12)
+  durations = 2.0 * peak / accel + (lengths - 2.0 * ramp) / peak
+  durations[lengths == 0] = 0.0
+  starts = np.concatenate([[0.0], np.cumsum(durations)[:-1]])
+
+  ramp, peak, duration = ramp[edge], peak[edge], durations[edge]
+  speeding_up = np.sqrt(2.0 * np.maximum(along, 0.0) / accel)
+  slowing_down = duration - np.sqrt(2.0 * np.maximum(length - along, 0.0) / accel)
+  cruising = peak / accel + (along - ramp) / peak
+  local = np.where(along < ramp, speeding_up, np.where(along > length - ramp, slowing_down, cruising))
+  return starts[edge] + local
+
+"""
+@function: pen_speeds
+@description: the fastest the pen can cruise along each edge of a
+resampled path (points and corners from planning.resample, path the
+N + 1 joint angles that draw it) without any joint going over max_speed.
+@return: one speed per edge, in pixels per second
+"""
+def pen_speeds(path, points, corners, max_speed=MAX_JOINT_SPEED, speed=PEN_SPEED):
+  points = np.asarray(points, dtype=np.float64)
+  closed = np.vstack([points, points[:1]])
+  step = np.sqrt((np.diff(closed, axis=0) ** 2).sum(axis=1))
+  radians_per_pixel = np.abs(np.diff(np.asarray(path, dtype=np.float64), axis=0)).max(axis=1) / np.maximum(step, 1e-12)
+  worst = np.zeros(np.count_nonzero(corners))
+  np.maximum.at(worst, np.cumsum(corners) - 1, radians_per_pixel)
+  return np.minimum(speed, max_speed / np.maximum(worst, 1e-12))
+
+"""
+@function: slow_down
+@description: stretch a timed joint path, keeping its shape, until no
+joint moves faster than max_speed anywhere along it.
+@return: the new times
+"""
+def slow_down(path, times, max_speed=MAX_JOINT_SPEED):
+  path = np.asarray(path, dtype=np.float64)
+  times = np.asarray(times, dtype=np.float64)
+  fastest = (np.abs(np.diff(path, axis=0)).max(axis=1) / np.maximum(np.diff(times), 1e-12)).max()
+  return times * max(1.0, fastest / max_speed)
+
+"""
+@class: MotionHandle
+@description: a trajectory that has been sent to ALMotion with a post call.
+wait() blocks until the arm is done; done() checks without blocking.
+"""
+class MotionHandle(object):
+  def __init__(self, proxy, task_id, times):
+    self.proxy = proxy
+    self.task_id = task_id
+    self.times = times
+    self.started = time.time()
+    self.duration = float(times[-1]) if len(times) else 0.0
+
+  def done(self):
+    return not self.proxy.isRunning(self.task_id)
+
+  def wait(self, timeout=None):
+    # ALMotion.wait takes its timeout in milliseconds, 0 meaning forever
+    return self.proxy.wait(self.task_id, 0 if timeout is None else int(timeout * 1000))
+
+  def cancel(self):
+    self.proxy.stop(self.task_id)
+
+"""
+@class: TrajectoryExecutor
+@description: draws a whole joint path with one angleInterpolation call
+instead of a setAngles and a sleep per point. The call is posted so it
+returns right away with a MotionHandle.
+"""
+class TrajectoryExecutor(object):
+  def __init__(self, proxy, effector="RArm", max_speed=MAX_JOINT_SPEED):
+    self.proxy = proxy
+    self.effector = effector
+    self.joints = ARM_JOINTS[effector]
+    self.max_speed = max_speed
+
+  """
+  @function: execute
+  @description: send a joint path to the arm. With times (from 0 at the
+  first point, like trapezoid_times) the path keeps its own timing,
+  after a move from start to the first point at max_speed.
+  @return: a MotionHandle
+  """
+  def execute(self, path, start=None, times=None):
+    path = np.asarray(path, dtype=np.float64)
+    if start is None:
+      start = self.proxy.getAngles(self.effector, True)
+    if times is None:
+      times = path_times(path, start, self.max_speed)
+    else:
+      times = path_times(path[:1], start, self.max_speed)[0] + np.asarray(times, dtype=np.float64)
+
+    # angleInterpolation wants one list of angles and times per joint
+    angleLists = path[:, :len(self.joints)].T.tolist()
+    timeLists = [times.tolist()] * len(self.joints)
+    task_id = self.proxy.post.angleInterpolation(self.joints, angleLists, timeLists, True)
+    return MotionHandle(self.proxy, task_id, times)
@@ -0,0 +1,402 @@
+"""
+@file: vision.py
+@authors: Tommy Lin, TJ Maynes
+@subject: cheaper ways for NAO to find the shape it is looking at.
+"""
+
+import threading
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+"""
+
+global variables
+
+"""
+# coarse pass runs at this fraction of the frame size (0.5 is QVGA from VGA)
+ROI_SCALE = 0.5
+
+# pixels of padding around the shape's box, and how far outside last
+# frame's box to look for it in the next frame
+ROI_MARGIN = 12
+ROI_SEARCH = 48
+
+# adaptive Canny: the high threshold is this many times the contrast
+# between the dark and light parts of the frame, and low this fraction of
+# high (or, by median, they sit sigma either side of the median). The
+# histogram uses every n-th pixel in each direction, and each frame moves
+# the thresholds this fraction of the way to its own.
+CANNY_CONTRAST = 4.0
+CANNY_RATIO = 0.1
+
+# never go below this low threshold, or the camera's own noise turns into edges
+CANNY_FLOOR = 10.0
+CANNY_SIGMA = 0.33
+CANNY_SUBSAMPLE = 4
+CANNY_SMOOTHING = 0.2
+
+# frames whose hashes differ in at most this many bits count as the same
+# card, and this many cards are remembered. The hash only looks at every
+# n-th pixel in each direction.
+HASH_DISTANCE = 2
+CACHE_SIZE = 16
+HASH_SUBSAMPLE = 4
+
+# the hash alone can't tell a square from a circle in the same place, so
+# two frames are only the same card if their thumbnails (every
+# THUMBNAIL_SCALE x THUMBNAIL_SCALE block averaged) also differ by no more
+# than THUMBNAIL_TOLERANCE grey levels anywhere
+THUMBNAIL_SCALE = 8
+THUMBNAIL_TOLERANCE = 24
+
+# the approxPolyDP tolerance (a fraction of arc length) a contour's corners
+# are counted with, which turns even a small circle into five or more, and
+# how round (4 pi area / perimeter^2) it has to be to be a circle
+CIRCULARITY = 0.86
+CLASSIFY_TOLERANCE = 0.04
+
+# optical flow: each vertex is followed inside a patch reaching FLOW_REACH
+# pixels around it, with FLOW_WINDOW pixel windows over FLOW_LEVELS
+# halvings of the patch. A vertex is lost when following it back to the
+# last frame misses by more than FLOW_DRIFT pixels, and a shape when its
+# area drifts more than FLOW_AREA_CHANGE from when Canny found it. Canny
+# runs anyway every FLOW_REFRESH frames, to see shapes that have come in.
+FLOW_REACH = 32
+FLOW_WINDOW = 15
+FLOW_LEVELS = 2
+FLOW_DRIFT = 1.0
+FLOW_AREA_CHANGE = 0.25
+FLOW_REFRESH = 30
+
+"""
+@class: RoiTracker
+@description: finds the box around the shape on a downscaled frame, so full
+resolution Canny only has to run inside it. The box is tracked from frame
+to frame: the coarse pass only searches near where the shape was last
+time, and only falls back to the whole frame when it isn't there.
+"""
+class RoiTracker(object):
+  def __init__(self, scale=ROI_SCALE, margin=ROI_MARGIN, search=ROI_SEARCH, low=10, high=100):
+    self.scale = scale
+    self.margin = margin
+    self.search = search
+    self.low = low
+    self.high = high
+    self.roi = None
+
+  def reset(self):
+    self.roi = None
+
+  def _expand(self, box, by, width, height):
+    x0, y0, x1, y1 = box
+    return (max(0, x0 - by), max(0, y0 - by), min(width, x1 + by), min(height, y1 + by))
+
+  """
+  @function: _coarse_box
+  @description: Canny on a downscaled part of the frame.
+  @return: the box around every edge found, in full frame pixels, or None
+  """
+  def _coarse_box(self, gray, window):
+    x0, y0, x1, y1 = window
+    small = cv2.resize(gray[y0:y1, x0:x1], None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+    canny = cv2.Canny(cv2.GaussianBlur(small, (3,3), 0), self.low, self.high)
+    rows = np.flatnonzero(canny.any(axis=1))
+    columns = np.flatnonzero(canny.any(axis=0))
+    if not len(rows):
+      return None
+    return (x0 + int(columns[0] / self.scale), y0 + int(rows[0] / self.scale),
+            x0 + int(np.ceil((columns[-1] + 1) / self.scale)), y0 + int(np.ceil((rows[-1] + 1) / self.scale)))
+
+  """
+  @function: locate
+  @description: where the shape is in this frame.
+  @return: (x0, y0, x1, y1) in full frame pixels, or None if there is nothing
+  """
+  def locate(self, gray):
+    height, width = gray.shape[:2]
+    box = None
+    if self.roi is not None:
+      window = self._expand(self.roi, self.search, width, height)
+      box = self._coarse_box(gray, window)
+
+      # the shape runs off the edge of the window, so it has moved too far
+      if box is not None and ((box[0] <= window[0] > 0) or (box[1] <= window[1] > 0) or
+                              (box[2] >= window[2] < width) or (box[3] >= window[3] < height)):
+        box = None
+    if box is None:
+      box = self._coarse_box(gray, (0, 0, width, height))
+    self.roi = None if box is None else self._expand(box, self.margin, width, height)
+    return self.roi
+
+"""
+@class: AdaptiveThresholds
+@description: Canny thresholds worked out from each frame instead of fixed,
+so a change in lighting doesn't flood us with noise or lose the shape.
+One histogram of every subsample-th pixel gives either the median (the
+thresholds sit sigma either side of it) or Otsu's split into dark and
+light (high follows the contrast between the two, low is a fixed ratio of
+high like the old 10 and 100). The thresholds are smoothed over the frame
+stream.
+"""
+class AdaptiveThresholds(object):
+  def __init__(self, method="median", sigma=CANNY_SIGMA, subsample=CANNY_SUBSAMPLE, smoothing=CANNY_SMOOTHING):
+    if method not in ("median", "otsu"):
+      raise ValueError('method must be "median" or "otsu"')
+    self.method = method
+    self.sigma = sigma
+    self.subsample = subsample
+    self.smoothing = smoothing
+    self.low = None
+    self.high = None
+
+  def reset(self):
+    self.low = None
+    self.high = None
+
+  """
+  @function: measure
+  @description: thresholds for one frame, without any smoothing. Either
+  way they are kept above CANNY_FLOOR.
+  @return: low and high thresholds
+  """
+  def measure(self, gray):
+    histogram = np.bincount(gray[::self.subsample, ::self.subsample].ravel(), minlength=256).astype(np.float64)
+    if self.method == "median":
+      median = np.searchsorted(histogram.cumsum(), histogram.sum() / 2.0)
+      return self._floor((1.0 - self.sigma) * median, min(255.0, (1.0 + self.sigma) * median))
+
+    # Otsu: the level that best splits the histogram into dark and light,
+    # and the edges we want are about as strong as the step between them
+    levels = np.arange(256)
+    weight = histogram.cumsum()
+    mean = (histogram * levels).cumsum()
+    total = weight[-1]
+    between = (mean[-1] * weight - mean * total) ** 2 / np.maximum(weight * (total - weight), 1e-12)
+    otsu = between.argmax()
+    dark = mean[otsu] / max(weight[otsu], 1.0)
+    light = (mean[-1] - mean[otsu]) / max(total - weight[otsu], 1.0)
+    high = CANNY_CONTRAST * (light - dark)
+    return self._floor(high * CANNY_RATIO, high)
+
+  # a dark or flat frame would otherwise put the thresholds down in the noise
+  def _floor(self, low, high):
+    return max(CANNY_FLOOR, low), max(CANNY_FLOOR / CANNY_RATIO / 3.0, high)
+
+  """
+  @function: update
+  @description: fold a new frame into the smoothed thresholds.
+  @return: low and high thresholds for this frame
+  """
+  def update(self, gray):
+    low, high = self.measure(gray)
+    if self.low is None:
+      self.low, self.high = low, high
+    else:
+      self.low += self.smoothing * (low - self.low)
+      self.high += self.smoothing * (high - self.high)
+    return self.low, self.high
+
+"""
+@function: frame_hash
+@description: a 64 bit perceptual (difference) hash of a greyscale frame:
+shrink it to 9 x 8 and note whether each pixel is brighter than the one
+to its right. Small changes in lighting or noise leave it the same.
+@return: the hash as an int
+"""
+def frame_hash(gray):
+  small = cv2.resize(gray[::HASH_SUBSAMPLE, ::HASH_SUBSAMPLE], (9, 8), interpolation=cv2.INTER_AREA)
+  bits = (small[:, 1:] > small[:, :-1]).ravel()
+  return int(np.packbits(bits).view('>u8')[0])
+
+"""
+@function: hash_distance
+@description: how many bits two frame hashes differ in.
+@return: the Hamming distance
+"""
+def hash_distance(a, b):
+  return bin(a ^ b).count("1")
+
+"""
+@function: card_key
+@description: what the shape cache knows a frame by: its hash, to find
+cards that might be the same quickly, and a small thumbnail, to make sure.
+@return: (hash, thumbnail)
+"""
+def card_key(gray):
+  # whole blocks only, which is a lot quicker for INTER_AREA
+  height, width = gray.shape[:2]
+  rows, columns = height // THUMBNAIL_SCALE, width // THUMBNAIL_SCALE
+  thumbnail = cv2.resize(gray[:rows * THUMBNAIL_SCALE, :columns * THUMBNAIL_SCALE], (columns, rows), interpolation=cv2.INTER_AREA)
+  return frame_hash(gray), thumbnail.astype(np.int16)
+
+"""
+@function: same_card
+@description: whether two card_keys are of the same card, in the same place.
+@return: True if they are
+"""
+def same_card(a, b, max_distance=HASH_DISTANCE, tolerance=THUMBNAIL_TOLERANCE):
+  return (hash_distance(a[0], b[0]) <= max_distance and a[1].shape == b[1].shape and
+          np.abs(a[1] - b[1]).max() <= tolerance)
+
+"""
+@function: classify
+@description: name a contour, as findContours gives it (simplified ones
+have lost the roundness of a circle), by how many corners it has, or
+how round it is when it has more than four.
+@return: "triangle", "square", "circle" or "shape"
+"""
+def classify(contour):
+  perimeter = cv2.arcLength(contour, True)
+  if perimeter == 0:
+    return "shape"
+  vertices = len(cv2.approxPolyDP(contour, CLASSIFY_TOLERANCE * perimeter, True))
+  if vertices == 3:
+    return "triangle"
+  if vertices == 4:
+    return "square"
+  if 4 * np.pi * cv2.contourArea(contour) / perimeter ** 2 >= CIRCULARITY:
+    return "circle"
+  return "shape"
+
+"""
+@class: ContourTracker
+@description: follows the corners of the shapes Canny found from frame to
+frame with pyramidal Lucas-Kanade optical flow, so Canny and
+findContours only have to run again when the shapes are lost. Each
+corner is tracked in a small patch of its own, so a frame costs the same
+whatever its size, and twice as much for twice the corners. Every corner
+is tracked forwards and back again; if any of them doesn't come back to
+where it started, or a shape grows or shrinks, the shapes are lost.
+"""
+class ContourTracker(object):
+  def __init__(self, reach=FLOW_REACH, window=FLOW_WINDOW, levels=FLOW_LEVELS, drift=FLOW_DRIFT,
+               area_change=FLOW_AREA_CHANGE, refresh=FLOW_REFRESH):
+    self.reach = reach
+    self.window = window
+    self.levels = levels
+    self.drift = drift
+    self.area_change = area_change
+    self.refresh = refresh
+    self.tracked = 0
+    self.lost = 0
+    self.reset()
+
+  def reset(self):
+    self.frame = None
+    self.polygons = None
+    self.labels = None
+    self.areas = None
+    self.age = 0
+
+  """
+  @function: start
+  @description: track these shapes (as found by Canny in gray) from now on.
+  """
+  def start(self, gray, polygons, labels):
+    if not len(polygons):
+      self.reset()
+      return
+    self.frame = gray
+    self.polygons = [np.asarray(polygon, dtype=np.float32).reshape(-1, 2) for polygon in polygons]
+    self.labels = list(labels)
+    self.areas = [cv2.contourArea(polygon) for polygon in self.polygons]
+    self.age = 0
+
+  """
+  @function: _flow
+  @description: where points in before have moved to in after.
+  @return: the moved points (N x 2) and which of them were found (N)
+  """
+  def _flow(self, before, after, points):
+    height, width = before.shape[:2]
+    size = 2 * self.reach
+    moved = np.empty_like(points)
+    found = np.zeros(len(points), dtype=bool)
+    for n, (x, y) in enumerate(points):
+      x0 = int(max(0, min(width - size, round(x) - self.reach)))
+      y0 = int(max(0, min(height - size, round(y) - self.reach)))
+      corner = np.array([[[x - x0, y - y0]]], dtype=np.float32)
+      to, status, error = cv2.calcOpticalFlowPyrLK(before[y0:y0 + size, x0:x0 + size], after[y0:y0 + size, x0:x0 + size],
+                                                   corner, None, winSize=(self.window, self.window), maxLevel=self.levels)
+      moved[n] = to[0, 0] + (x0, y0)
+      found[n] = status[0, 0] == 1
+    return moved, found
+
+  """
+  @function: track
+  @description: the shapes in this frame, followed from the last one.
+  @return: the contours (like approxPolyDP gives them) and their labels,
+  or None when there is nothing to track or it was lost
+  """
+  def track(self, gray):
+    if self.frame is None or self.age >= self.refresh or gray.shape != self.frame.shape:
+      return None
+    points = np.vstack(self.polygons)
+    moved, found = self._flow(self.frame, gray, points)
+    back, found_back = self._flow(gray, self.frame, moved)
+    found &= found_back & (np.sqrt(((back - points) ** 2).sum(axis=1)) <= self.drift)
+
+    polygons = np.split(moved, np.cumsum([len(polygon) for polygon in self.polygons])[:-1])
+    if found.all():
+      for polygon, area in zip(polygons, self.areas):
+        if abs(cv2.contourArea(polygon) - area) > self.area_change * area:
+          found[:] = False
+          break
+    if not found.all():
+      self.lost += 1
+      self.reset()
+      return None
+
+    self.frame = gray
+    self.polygons = polygons
+    self.age += 1
+    self.tracked += 1
+    return [np.round(polygon).astype(np.int32).reshape(-1, 1, 2) for polygon in polygons], list(self.labels)
+
+"""
+@class: ShapeCache
+@description: remembers what was worked out for the last few cards NAO
+saw (the simplified contours, their labels and joint paths), by their
+card_key. A frame is a hit when it is the same_card as a cached one. The
+least recently used card is forgotten first. Safe to share between the
+pipeline's vision and planning stages.
+"""
+class ShapeCache(object):
+  def __init__(self, size=CACHE_SIZE, max_distance=HASH_DISTANCE, tolerance=THUMBNAIL_TOLERANCE):
+    self.size = size
+    self.max_distance = max_distance
+    self.tolerance = tolerance
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    with self._lock:
+      match = None
+      for cached, (thumbnail, entry) in self._entries.items():
+        if same_card((cached, thumbnail), key, self.max_distance, self.tolerance):
+          match = cached
+          break
+      if match is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      thumbnail, entry = self._entries.pop(match)
+      self._entries[match] = (thumbnail, entry)
+      return entry
+
+  def put(self, key, polygons, labels, paths):
+    with self._lock:
+      self._entries.pop(key[0], None)
+      self._entries[key[0]] = (key[1], (polygons, labels, paths))
+      while len(self._entries) > self.size:
+        self._entries.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()